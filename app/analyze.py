@@ -1,8 +1,50 @@
 import math
+from collections import OrderedDict
+from functools import cached_property
 
 import librosa
 import numpy as np
 
+from cache import ArrayWriter
+from chroma import chroma_vectors
+from instrument import Instrumentation
+from pyramid import SpectrogramPyramid
+from ringbuffer import RingBuffer
+
+# STFT で一度に rfft するフレーム数 (ピークメモリを抑えるため)
+STFT_BLOCK_FRAMES = 256
+
+# スペクトログラムから特徴量を計算するときに一度に読むフレーム数
+SPECTROGRAM_BLOCK_FRAMES = 1024
+
+# 基本周波数推定で探索する周波数の範囲 [Hz]
+F0_MIN = 50.0
+F0_MAX = 1000.0
+
+# LiveAnalyzer が 1 チャンクごとに記録する値 (ノートナンバーと対数 RMS)
+TRACK_DTYPE = np.dtype([("nn", np.float32), ("db", np.float32)])
+
+# PitchTracker が 1 フレームごとに返す値 (nn は小数のノートナンバー，無声なら f0 = nn = 0)
+PITCH_DTYPE = np.dtype(
+    [
+        ("f0", np.float32),
+        ("nn", np.float32),
+        ("db", np.float32),
+        ("clarity", np.float32),
+        ("voiced", np.bool_),
+    ]
+)
+
+# フレームごとの特徴量 (ゼロ交差率，RMS，対数 RMS，スペクトル重心 [Hz])
+FRAME_FEATURE_DTYPE = np.dtype(
+    [
+        ("zcr", np.float32),
+        ("rms", np.float32),
+        ("db", np.float32),
+        ("centroid", np.float32),
+    ]
+)
+
 
 # ノートナンバーから周波数へ
 def nn2hz(notenum):
@@ -14,46 +56,612 @@ def hz2nn(frequency):
     return int(round(12.0 * (math.log(frequency / 440.0) / math.log(2.0)))) + 69
 
 
+# 正弦波を生成する (generate_sinusoid.pyより)
+def generate_sinusoid(sampling_rate, frequency, duration):
+    sampling_interval = 1.0 / sampling_rate
+    t = np.arange(sampling_rate * duration) * sampling_interval
+    waveform = np.sin(2.0 * math.pi * frequency * t)
+    return waveform
+
+
 class AudioAnalyzer:
     SR = 16000
     frame_size = 4096
+    shift_size = SR // 100  # 0.01 秒 (10 msec)
 
-    def __init__(self, audio_path):
-        self.wave, _ = librosa.load(audio_path, sr=self.SR)
-        self.spectrogram = self._get_spectrogram(self.wave)
+    def __init__(
+        self, audio_path, cache=None, lazy=False, stream=False, on_frames=None
+    ):
+        """
+        Decode `audio_path` and compute its spectrogram, reusing the results stored in `cache` (a FeatureCache) if given.
+        With `lazy=True` a spectrogram that is not cached yet is computed tile by tile as it is accessed (see LazySpectrogram).
+        With `stream=True` the file is decoded block by block and the spectrogram and frame features are computed
+        from each block as it arrives (see stream.iter_blocks), instead of decoding the whole file first; the
+        rows go straight into arrays allocated once, and `on_frames(start, spectra, features)` is called with
+        the rows of each block (or once with all of them if they were cached) as soon as they are computed.
+        """
+        self.cache = cache
+        self.on_frames = on_frames
+        self._key = None
+        if cache is not None:
+            # 逐次デコードはリサンプラが違うので，波形を別に保存する
+            decoder = {"decoder": "stream"} if stream else {}
+            self._key = cache.key(
+                audio_path,
+                sr=self.SR,
+                frame_size=self.frame_size,
+                shift_size=self.shift_size,
+                window="hamming",
+                **decoder,
+            )
+        if stream:
+            self._ingest(audio_path)
+        else:
+            self.wave = self.cached(
+                "wave", lambda: librosa.load(audio_path, sr=self.SR)[0]
+            )
+            spectrogram = None
+            if cache is not None:
+                spectrogram = cache.load(self._key, "spectrogram")
+            if spectrogram is None and lazy:
+                spectrogram = LazySpectrogram(
+                    self.wave, self.frame_size, self.shift_size
+                )
+            if spectrogram is None:
+                spectrogram = self.cached(
+                    "spectrogram", lambda: self._get_spectrogram(self.wave)
+                )
+            self.spectrogram = spectrogram
+        # 表示用の縮小版は必要になったときに作る
+        self.pyramid = SpectrogramPyramid(self.spectrogram, cache, self._key)
+
+    @cached_property
+    def chroma(self):
+        """Chroma vectors of every frame of the spectrogram, shape (n_frames, 12), computed on first access"""
+        return self.cached(
+            "chroma",
+            lambda: chroma_vectors(self.spectrogram, self.SR, self.frame_size),
+        )
+
+    @cached_property
+    def features(self):
+        """ZCR, RMS, dB and spectral centroid of every frame of the spectrogram (FRAME_FEATURE_DTYPE)"""
+        return self.cached(
+            "features",
+            lambda: get_frame_features(
+                self.wave, self.SR, self.frame_size, self.shift_size, self.spectrogram
+            ),
+        )
+
+    def _ingest(self, audio_path, block_size=None):
+        """
+        Fill the wave, spectrogram and frame features in one pass over the blocks of `audio_path`, writing each
+        block's rows straight into arrays sized from the file's header (memory-mapped in the cache if given)
+        """
+        from stream import (
+            STREAM_BLOCK_SIZE,
+            StreamingFramer,
+            expected_samples,
+            iter_blocks,
+        )
+
+        names = ("wave", "spectrogram", "features")
+        if self.cache is not None:
+            arrays = [self.cache.load(self._key, name) for name in names]
+            if all(array is not None for array in arrays):
+                self.wave, self.spectrogram, self.__dict__["features"] = arrays
+                if self.on_frames is not None:
+                    self.on_frames(0, self.spectrogram, self.features)
+                return
+
+        n_samples = expected_samples(audio_path, self.SR)
+        n_frames = max(len(range(0, n_samples - self.frame_size, self.shift_size)), 0)
+        shapes = (
+            (n_samples, (), np.float32),
+            (n_frames, (self.frame_size // 2 + 1,), np.float32),
+            (n_frames, (), FRAME_FEATURE_DTYPE),
+        )
+        if self.cache is None:
+            writers = [ArrayWriter(*shape) for shape in shapes]
+        else:
+            writers = [
+                self.cache.writer(self._key, name, *shape)
+                for name, shape in zip(names, shapes)
+            ]
+        wave, spectrogram, features = writers
+        window = np.hamming(self.frame_size)
+        framer = StreamingFramer(self.frame_size, self.shift_size)
+        for block in iter_blocks(audio_path, self.SR, block_size or STREAM_BLOCK_SIZE):
+            wave.append(block)
+            start = framer.n_frames
+            frames = framer.push(block)
+            if len(frames) > 0:
+                spectra = log_spectra(frames, window)
+                values = frame_features(frames, spectra, self.SR)
+                spectrogram.append(spectra)
+                features.append(values)
+                if self.on_frames is not None:
+                    self.on_frames(start, spectra, values)
+        # features は cached_property なので，計算済みの値を先に入れておく
+        self.wave, self.spectrogram, self.__dict__["features"] = [
+            writer.finish() for writer in writers
+        ]
+
+    def cached(self, name, compute):
+        """
+        Return feature `name` of this file from the cache, computing it with `compute()` if needed (always without
+        a cache). Other modules store their features of the song here too; `name` must encode every parameter
+        of `compute` that is not part of the cache key.
+        """
+        if self.cache is None:
+            return compute()
+        return self.cache.get_or_compute(self._key, name, compute)
 
     def _get_spectrogram(self, x):
-        hamming_window = np.hamming(self.frame_size)  # フレームサイズに合わせてハミング窓を作成
-        shift_size = self.SR / 100  # 0.01 秒 (10 msec)
-        spectrogram = []
-        for i in range(0, len(x) - self.frame_size, int(shift_size)):
-            x_frame = x[i : i + self.frame_size]
-            x_fft = np.log(np.abs(np.fft.rfft(x_frame * hamming_window)))
-            spectrogram.append(x_fft)
-        return np.array(spectrogram)
+        return get_spectrogram(x, self.SR, self.frame_size)
+
+
+class LazySpectrogram:
+    """
+    Log amplitude spectrogram (same values as `stft`) whose frames are computed in tiles of `tile_frames` on demand.
+
+    Supports `spectrogram[t]`, `spectrogram[t, :]`, row slices, `.shape`, `.min()` and `.max()` like an ndarray.
+    Up to `max_tiles` recently used tiles are kept in memory; if `path` is given, tiles are instead written to a
+    memory-mapped float32 .npy file there, so the OS pages them in and out.
+    """
+
+    dtype = np.dtype(np.float32)
+    ndim = 2
+
+    def __init__(
+        self,
+        wave,
+        frame_size,
+        shift_size,
+        window=None,
+        tile_frames=256,
+        max_tiles=64,
+        path=None,
+    ):
+        self.wave = wave
+        self.frame_size = frame_size
+        self.shift_size = shift_size
+        self.window = np.hamming(frame_size) if window is None else window
+        self.tile_frames = tile_frames
+        self.max_tiles = max_tiles
+        n_frames = max(len(range(0, len(wave) - frame_size, shift_size)), 0)
+        self.shape = (n_frames, frame_size // 2 + 1)
+        self.n_tiles = -(-n_frames // tile_frames)
+
+        self._tiles = OrderedDict()  # タイル番号 -> 配列 (最近使ったものが末尾)
+        self._store = None
+        if path is not None:
+            self._store = np.lib.format.open_memmap(
+                path, mode="w+", dtype=self.dtype, shape=self.shape
+            )
+            self._computed = np.zeros(self.n_tiles, dtype=bool)
+        self._min = None
+        self._max = None
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        spectrogram = np.empty(self.shape, dtype=self.dtype)
+        for k in range(self.n_tiles):
+            spectrogram[k * self.tile_frames : (k + 1) * self.tile_frames] = self.tile(
+                k
+            )
+        return spectrogram if dtype is None else spectrogram.astype(dtype)
+
+    @property
+    def T(self):
+        return np.asarray(self).T
+
+    def __getitem__(self, key):
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        if isinstance(rows, (int, np.integer)):
+            if rows < 0:
+                rows += self.shape[0]
+            if not 0 <= rows < self.shape[0]:
+                raise IndexError(
+                    f"index {rows} is out of bounds for {self.shape[0]} frames"
+                )
+            k, i = divmod(rows, self.tile_frames)
+            return self.tile(k)[i, cols]
+        start, stop, step = rows.indices(self.shape[0])
+        if stop <= start:
+            return np.empty((0, self.shape[1]), dtype=self.dtype)[:, cols]
+        first, last = start // self.tile_frames, (stop - 1) // self.tile_frames
+        block = np.concatenate([self.tile(k) for k in range(first, last + 1)])
+        offset = first * self.tile_frames
+        return block[start - offset : stop - offset : step, cols]
+
+    def tile(self, k):
+        """Frames [k * tile_frames, (k + 1) * tile_frames) as an array, computing them if needed"""
+        if self._store is not None:
+            tile = self._store[k * self.tile_frames : (k + 1) * self.tile_frames]
+            if not self._computed[k]:
+                tile[:] = self._compute(k)
+                self._computed[k] = True
+            return tile
+        if k in self._tiles:
+            self._tiles.move_to_end(k)
+            return self._tiles[k]
+        tile = self._compute(k)
+        self._tiles[k] = tile
+        if len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+        return tile
+
+    def _compute(self, k):
+        start = k * self.tile_frames
+        stop = min(start + self.tile_frames, self.shape[0])
+        # stft は最後のフレームの開始位置を len - frame_size 未満に限るので 1 サンプル余分に渡す
+        x = self.wave[
+            start * self.shift_size : (stop - 1) * self.shift_size + self.frame_size + 1
+        ]
+        return stft(x, self.frame_size, self.shift_size, self.window)
+
+    def _extrema(self):
+        mins = []
+        maxs = []
+        for k in range(self.n_tiles):
+            tile = self.tile(k)
+            mins.append(tile.min())
+            maxs.append(tile.max())
+        self._min = min(mins)
+        self._max = max(maxs)
+
+    def min(self):
+        if self._min is None:
+            self._extrema()
+        return self._min
+
+    def max(self):
+        if self._max is None:
+            self._extrema()
+        return self._max
+
+
+class PitchTracker:
+    """
+    Streaming F0 tracker with voicing detection.
+
+    Every `hop` samples, the latest `frame_size` samples (overlapping windows) are analyzed with one FFT-based
+    autocorrelation. A frame is voiced when it is both loud enough (log RMS >= `db_threshold`) and periodic
+    enough (normalized autocorrelation peak >= `clarity_threshold`). Its F0 is then replaced by the median over
+    the voiced frames within `lookahead` frames on either side, which removes isolated octave jumps.
+    A frame is therefore reported `lookahead` hops after it was captured, and `lookahead` is chosen as the
+    largest number of hops that fits in `max_latency` seconds.
+    """
+
+    def __init__(
+        self,
+        sr,
+        hop=1024,
+        frame_size=2048,
+        max_latency=0.15,
+        db_threshold=-7.6,
+        clarity_threshold=0.5,
+        f0_min=F0_MIN,
+        f0_max=F0_MAX,
+    ):
+        if max_latency < 0:
+            raise ValueError("max_latency must not be negative")
+        self.sr = sr
+        self.hop = hop
+        self.frame_size = frame_size
+        self.lookahead = int(max_latency * sr / hop)
+        self.db_threshold = db_threshold
+        self.clarity_threshold = clarity_threshold
+        self.f0_min = f0_min
+        self.f0_max = f0_max
+
+        self._frame = np.zeros(frame_size, dtype=np.float32)  # 直近 frame_size サンプル
+        self._pending = np.zeros(0, dtype=np.float32)  # 1 ホップに満たないサンプル
+        self._recent = np.zeros(2 * self.lookahead + 1, dtype=PITCH_DTYPE)
+        self.n_frames = 0  # 解析したフレーム数
+
+    @property
+    def latency(self):
+        """Delay [sec] between the end of a hop and the output of its frame"""
+        return self.lookahead * self.hop / self.sr
+
+    def push(self, x):
+        """Feed the next samples and return the PITCH_DTYPE records of the frames that became final"""
+        x = np.concatenate([self._pending, np.asarray(x, dtype=np.float32)])
+        n_hops = len(x) // self.hop
+        out = np.zeros(n_hops, dtype=PITCH_DTYPE)
+        n_out = 0
+        for i in range(n_hops):
+            self._frame = np.concatenate(
+                [self._frame[self.hop :], x[i * self.hop : (i + 1) * self.hop]]
+            )[-self.frame_size :]
+            self._recent[self.n_frames % len(self._recent)] = self._analyze(self._frame)
+            self.n_frames += 1
+            t = self.n_frames - 1 - self.lookahead  # 確定するフレーム
+            if t >= 0:
+                out[n_out] = self._smooth(t)
+                n_out += 1
+        self._pending = x[n_hops * self.hop :]
+        return out[:n_out]
+
+    def _analyze(self, frame):
+        record = np.zeros((), dtype=PITCH_DTYPE)
+        energy = np.mean(np.square(frame, dtype=np.float64))
+        record["db"] = np.log(np.sqrt(energy)) if energy > 0 else -np.inf
+        if record["db"] < self.db_threshold:
+            return record
+        corr = autocorrelate(frame.astype(np.float64))
+        f0, clarity = _pick_f0(corr, self.sr, self.f0_min, self.f0_max)
+        record["clarity"] = clarity
+        if f0 > 0 and clarity >= self.clarity_threshold:
+            record["f0"] = f0
+            record["voiced"] = True
+        return record
+
+    def _smooth(self, t):
+        record = self._recent[t % len(self._recent)].copy()
+        if not record["voiced"]:
+            return record
+        first = max(t - self.lookahead, 0)
+        window = self._recent[
+            [k % len(self._recent) for k in range(first, t + self.lookahead + 1)]
+        ]
+        f0s = window["f0"][window["voiced"]]
+        # 対数周波数での中央値 (偶数個なら下側) にする
+        record["f0"] = np.sort(f0s)[(len(f0s) - 1) // 2]
+        record["nn"] = 12.0 * np.log2(record["f0"] / 440.0) + 69
+        return record
+
+
+class LiveAnalyzer:
+    """
+    Analyzes live input one chunk at a time.
+    The latest samples, the per-chunk F0 / dB track and the per-chunk spectrum are kept in ring buffers, so another thread can read them at its own rate.
+    The F0 / dB track comes from a PitchTracker with one frame per chunk, so it lags the input by `pitch.latency` seconds.
+    Spectra and frame features come from a StreamingFrameFeatures shifted by one chunk, one frame per chunk once `frame_size` samples have arrived.
+    """
+
+    def __init__(
+        self,
+        sr,
+        chunk,
+        window=12000,
+        history=60,
+        frame_size=4096,
+        instrument=None,
+        max_latency=0.15,
+        db_threshold=-7.6,
+    ):
+        from stream import StreamingFrameFeatures
+
+        self.sr = sr
+        self.chunk = chunk
+        self.frame_size = frame_size
+        self.frames = StreamingFrameFeatures(sr, frame_size, chunk, include_last=True)
+        self.recorded = RingBuffer(window)
+        self.pitch = PitchTracker(
+            sr,
+            hop=chunk,
+            frame_size=2 * chunk,
+            max_latency=max_latency,
+            db_threshold=db_threshold,
+        )
+        self.track = RingBuffer(history, dtype=TRACK_DTYPE)
+        self.spectra = RingBuffer(history, shape=(frame_size // 2 + 1,))
+        self.chroma = RingBuffer(history, shape=(12,))
+        self.features = RingBuffer(history, dtype=FRAME_FEATURE_DTYPE)
+        self.instrument = Instrumentation() if instrument is None else instrument
+
+    def process(self, x):
+        self.recorded.write(x)
+        with self.instrument.stage("f0"):
+            records = self.pitch.push(x)
+        for record in records:
+            self.track.write((record["nn"], record["db"]))
+        with self.instrument.stage("spectrum"):
+            spectra, features = self.frames.push(x)
+        if len(spectra) > 0:
+            self.spectra.write(spectra)
+            self.features.write(features)
+            with self.instrument.stage("chroma"):
+                self.chroma.write(chroma_vectors(spectra, self.sr, self.frame_size))
+
+
+def frame_view(x, frame_size, shift_size, include_last=False):
+    """
+    Return a read-only (n_frames, frame_size) view of `x` without copying.
+    Like the original loop, frames start at 0, shift_size, ... up to (but excluding) len(x) - frame_size,
+    unless `include_last` (then the frame ending at the last sample is included too).
+    """
+    x = np.ascontiguousarray(x)
+    n_frames = len(range(0, len(x) - frame_size + include_last, shift_size))
+    if n_frames <= 0:
+        return np.empty((0, frame_size), dtype=x.dtype)
+    return np.lib.stride_tricks.as_strided(
+        x,
+        shape=(n_frames, frame_size),
+        strides=(x.strides[0] * shift_size, x.strides[0]),
+        writeable=False,
+    )
+
+
+def spectrogram_blocks(spectrogram, block_frames=SPECTROGRAM_BLOCK_FRAMES):
+    """
+    Yield (start frame, float32 block of up to `block_frames` frames) over a spectrogram (ndarray, memmap or
+    LazySpectrogram), so features can be computed without loading it all at once.
+    """
+    for i in range(0, spectrogram.shape[0], block_frames):
+        yield i, np.asarray(spectrogram[i : i + block_frames], np.float32)
+
+
+def log_spectra(frames, window, block_frames=STFT_BLOCK_FRAMES):
+    """
+    Log amplitude spectra of each row of `frames` as a float32 array of shape (n_frames, frame_size // 2 + 1).
+    Frames are windowed and transformed `block_frames` at a time with one batched rfft call.
+    """
+    spectra = np.empty((frames.shape[0], frames.shape[1] // 2 + 1), dtype=np.float32)
+    for i in range(0, frames.shape[0], block_frames):
+        x_fft = np.fft.rfft(frames[i : i + block_frames] * window, axis=1)
+        with np.errstate(divide="ignore"):
+            np.log(np.abs(x_fft), out=spectra[i : i + block_frames], casting="unsafe")
+    return spectra
+
+
+def stft(x, frame_size, shift_size, window=None, block_frames=STFT_BLOCK_FRAMES):
+    """Compute the log amplitude spectrogram of `x` as a float32 array of shape (n_frames, frame_size // 2 + 1)"""
+    if window is None:
+        window = np.hamming(frame_size)  # フレームサイズに合わせてハミング窓を作成
+    return log_spectra(frame_view(x, frame_size, shift_size), window, block_frames)
+
+
+def log_rms(frames):
+    """Volume of each row of `frames` as log RMS (the dB value used by the karaoke app)"""
+    return _log(rms(frames))
+
+
+def rms(frames):
+    """Root mean square of each row of `frames`"""
+    return np.sqrt(np.mean(np.square(np.asarray(frames, dtype=np.float32)), axis=-1))
+
+
+def _log(x):
+    # 無音のフレームは警告を出さずに -inf にする
+    with np.errstate(divide="ignore"):
+        return np.log(x)
+
+
+def zero_crossing_rate(frames):
+    """Fraction of adjacent samples in each row of `frames` with opposite signs (the count of examples/zero_cross.py)"""
+    frames = np.asarray(frames)
+    crossings = np.count_nonzero(frames[..., 1:] * frames[..., :-1] < 0, axis=-1)
+    return (crossings / (frames.shape[-1] - 1)).astype(np.float32)
+
+
+def spectral_centroid(spectra, sr, frame_size):
+    """Amplitude-weighted mean frequency [Hz] of each row of a log amplitude spectrogram"""
+    amplitude = np.exp(np.asarray(spectra, dtype=np.float32))
+    frequencies = np.arange(amplitude.shape[-1], dtype=np.float32) * sr / frame_size
+    total = amplitude.sum(axis=-1)
+    return (amplitude @ frequencies / np.maximum(total, 1e-10)).astype(np.float32)
+
+
+def frame_features(frames, spectra, sr):
+    """FRAME_FEATURE_DTYPE record for each row of `frames`, given their log amplitude `spectra`"""
+    features = np.empty(len(frames), dtype=FRAME_FEATURE_DTYPE)
+    features["zcr"] = zero_crossing_rate(frames)
+    features["rms"] = rms(frames)
+    features["db"] = _log(features["rms"])
+    features["centroid"] = spectral_centroid(spectra, sr, frames.shape[-1])
+    return features
+
+
+def get_frame_features(
+    wave,
+    sr,
+    frame_size,
+    shift_size,
+    spectrogram=None,
+    window=None,
+    block_frames=STFT_BLOCK_FRAMES,
+):
+    """
+    Frame features (FRAME_FEATURE_DTYPE) of `wave` framed like `stft`, so row i belongs to spectrogram row i.
+    Pass the spectrogram if it has already been computed; otherwise the spectra are computed block by block.
+    """
+    if window is None:
+        window = np.hamming(frame_size)
+    frames = frame_view(np.asarray(wave, dtype=np.float32), frame_size, shift_size)
+    features = np.empty(len(frames), dtype=FRAME_FEATURE_DTYPE)
+    for i in range(0, len(frames), block_frames):
+        block = frames[i : i + block_frames]
+        if spectrogram is None:
+            spectra = log_spectra(block, window)
+        else:
+            spectra = spectrogram[i : i + block_frames]
+        features[i : i + block_frames] = frame_features(block, spectra, sr)
+    return features
 
 
 def get_spectrogram(wave, sr, frame_size):
-    hamming_window = np.hamming(frame_size)  # フレームサイズに合わせてハミング窓を作成
     shift_size = sr / 100  # 0.01 秒 (10 msec)
-    spectrogram = []
-    for i in range(0, len(wave) - frame_size, int(shift_size)):
-        x_frame = wave[i : i + frame_size]
-        x_fft = np.log(np.abs(np.fft.rfft(x_frame * hamming_window)))
-        spectrogram.append(x_fft)
-    return np.array(spectrogram)
+    return stft(wave, frame_size, int(shift_size))
+
+
+def autocorrelate(frames):
+    """Autocorrelation of each row of `frames` (lags 0 .. n - 1), computed via FFT (Wiener-Khinchin)"""
+    n = frames.shape[-1]
+    n_fft = 1 << (2 * n - 1).bit_length()  # 巡回相関にならないよう 2n-1 以上の 2 のべき乗
+    spec = np.fft.rfft(frames, n_fft, axis=-1)
+    return np.fft.irfft(spec.real ** 2 + spec.imag ** 2, n_fft, axis=-1)[..., :n]
 
 
-def get_f0(wave, sr):
-    corr = np.correlate(wave, wave, "full")
-    corr = corr[len(corr) // 2 :]
+def _pick_f0(corr, sr, f0_min, f0_max):
+    """
+    F0 [Hz] and clarity (normalized autocorrelation, 0 to 1) of each row from its autocorrelation (0 if no peak
+    within [f0_min, f0_max]). Takes the shortest-lag peak within 95% of the highest one, so a multiple of the
+    period is not chosen over it.
+    """
+    corr = np.asarray(corr)
+    n = corr.shape[-1]
+    lo = max(int(math.ceil(sr / f0_max)), 1)
+    hi = min(int(sr / f0_min), n - 2)
+    if hi < lo:
+        return np.zeros(corr.shape[:-1]), np.zeros(corr.shape[:-1])
+    energy = corr[..., :1]
+    c = corr[..., lo : hi + 1] / np.where(energy > 0, energy, 1)
+    # ラグ lo..hi のうち両隣よりも大きいものがピーク
+    is_peak = (corr[..., lo - 1 : hi] < corr[..., lo : hi + 1]) & (
+        corr[..., lo : hi + 1] >= corr[..., lo + 1 : hi + 2]
+    )
+    is_peak &= (c > 0) & (energy > 0)
+    highest = np.max(np.where(is_peak, c, 0), axis=-1, keepdims=True)
+    best = np.argmax(is_peak & (c >= 0.95 * highest), axis=-1)[..., None]
+    found = np.any(is_peak, axis=-1)
+    lag = best + lo
+    # 放物線補間でラグを 1 サンプルより細かく求める
+    left = np.take_along_axis(corr, lag - 1, axis=-1)[..., 0]
+    center = np.take_along_axis(corr, lag, axis=-1)[..., 0]
+    right = np.take_along_axis(corr, lag + 1, axis=-1)[..., 0]
+    denom = left - 2 * center + right
+    offset = np.where(
+        denom < 0, 0.5 * (left - right) / np.where(denom < 0, denom, 1), 0
+    )
+    f0 = np.where(found, sr / (lag[..., 0] + offset), 0.0)
+    clarity = np.where(found, np.take_along_axis(c, best, axis=-1)[..., 0], 0.0)
+    return f0, clarity
 
-    def is_peak(corr, i):
-        return 0 < i < len(corr) - 1 and corr[i - 1] < corr[i] < corr[i + 1]
 
-    peakindices = [i for i in range(len(corr)) if is_peak(corr, i)]
-    peakindices = [i for i in peakindices if i != 0]
-    if len(peakindices) == 0:
+def get_f0(wave, sr, f0_min=F0_MIN, f0_max=F0_MAX):
+    """Estimate F0 [Hz] of the whole `wave` from its autocorrelation (0 if no peak is found)"""
+    wave = np.asarray(wave, dtype=np.float64)
+    if len(wave) < 3:
         return 0
-    maxidx = max(peakindices, key=lambda index: corr[index])
-    return 1 / (maxidx / sr)
+    return float(_pick_f0(autocorrelate(wave), sr, f0_min, f0_max)[0])
+
+
+def get_f0_track(
+    wave,
+    sr,
+    frame_size=1024,
+    shift_size=None,
+    f0_min=F0_MIN,
+    f0_max=F0_MAX,
+    block_frames=STFT_BLOCK_FRAMES,
+):
+    """Estimate F0 [Hz] for every frame of `wave` (framed like `stft`) and return it as a float32 array"""
+    if shift_size is None:
+        shift_size = int(sr / 100)  # 0.01 秒 (10 msec)
+    frames = frame_view(np.asarray(wave, dtype=np.float32), frame_size, shift_size)
+    return frame_f0s(frames, sr, f0_min, f0_max, block_frames)
+
+
+def frame_f0s(frames, sr, f0_min=F0_MIN, f0_max=F0_MAX, block_frames=STFT_BLOCK_FRAMES):
+    """Estimate F0 [Hz] for each row of `frames` and return it as a float32 array"""
+    f0s = np.empty(frames.shape[0], dtype=np.float32)
+    for i in range(0, frames.shape[0], block_frames):
+        corr = autocorrelate(frames[i : i + block_frames])
+        f0s[i : i + block_frames] = _pick_f0(corr, sr, f0_min, f0_max)[0]
+    return f0s
@@ -0,0 +1,16 @@
+import numpy as np
+
+# paInt16 のサンプルを [-1, 1) に正規化するための係数
+INT16_SCALE = 1.0 / 32768.0
+
+
+def decode_pcm16(data, channels=1):
+    """
+    Convert raw paInt16 bytes (interleaved if `channels` > 1) from `stream.read` into mono float32 samples in [-1, 1).
+    Channels are averaged down to mono; no resampling is done.
+    """
+    samples = np.frombuffer(data, dtype=np.int16)
+    if channels > 1:
+        samples = samples[: len(samples) // channels * channels].reshape(-1, channels)
+        return samples.mean(axis=1, dtype=np.float32) * np.float32(INT16_SCALE)
+    return samples.astype(np.float32) * np.float32(INT16_SCALE)
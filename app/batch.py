@@ -0,0 +1,202 @@
+"""
+Precompute features of every audio file in a directory with a pool of worker processes.
+
+    python app/batch.py data --out features --workers 4
+
+For each file, `<out>/<relative path>.npz` (compressed) holds one array per feature, aligned frame by frame with
+AudioAnalyzer's spectrogram: spectrogram, volume (log RMS), f0 [Hz] and chroma. The spectrogram is stored as a
+128-band log mel spectrogram, or with `--spectrogram full` as the full log amplitude spectrogram, both in float16.
+Finished files are recorded in `<out>/manifest.json`, so running the same command again after an interruption
+only processes what is left.
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from pathlib import Path
+
+import librosa
+import numpy as np
+import scipy.sparse
+
+from analyze import (
+    AudioAnalyzer,
+    frame_f0s,
+    frame_view,
+    log_rms,
+    spectrogram_blocks,
+)
+
+AUDIO_SUFFIXES = {".wav", ".mp3", ".flac", ".ogg", ".m4a"}
+MANIFEST = "manifest.json"
+
+# メルスペクトログラムの帯域数
+N_MELS = 128
+
+# log(0) を避けるためのパワーの下限
+POWER_FLOOR = 1e-10
+
+
+@lru_cache(maxsize=None)
+def mel_matrix(sr, frame_size, n_mels=N_MELS):
+    """Sparse (n_mels, frame_size // 2 + 1) mel filterbank, built once per (sr, frame_size)"""
+    return scipy.sparse.csr_matrix(
+        librosa.filters.mel(sr=sr, n_fft=frame_size, n_mels=n_mels)
+    )
+
+
+def log_mel_spectrogram(spectrogram, sr, frame_size):
+    """Log mel power spectrogram (n_frames, N_MELS) of a log amplitude spectrogram, one block of frames at a time"""
+    m = mel_matrix(sr, frame_size)
+    mel = np.empty((spectrogram.shape[0], m.shape[0]), dtype=np.float32)
+    for i, block in spectrogram_blocks(spectrogram):
+        power = np.exp(2 * block)
+        mel[i : i + len(block)] = np.log(np.maximum(m.dot(power.T).T, POWER_FLOOR))
+    return mel
+
+
+def find_audio_files(directory):
+    return sorted(
+        path
+        for path in Path(directory).rglob("*")
+        if path.is_file() and path.suffix.lower() in AUDIO_SUFFIXES
+    )
+
+
+def analyze_file(audio_path, output_path, spectrogram="mel"):
+    """Compute the features of `audio_path`, write them to `output_path` and return (audio seconds, elapsed seconds)"""
+    st = time.perf_counter()
+    audio = AudioAnalyzer(str(audio_path))
+    frames = frame_view(audio.wave, audio.frame_size, audio.shift_size)
+    if spectrogram == "mel":
+        spectrogram = log_mel_spectrogram(audio.spectrogram, audio.SR, audio.frame_size)
+    else:
+        spectrogram = audio.spectrogram
+    features = {
+        "spectrogram": spectrogram.astype(np.float16),
+        "volume": log_rms(frames).astype(np.float32),
+        "f0": frame_f0s(frames, audio.SR),
+        "chroma": audio.chroma,
+    }
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # 途中で止まっても壊れたファイルが残らないよう，書き終えてから置き換える
+    tmp = output_path.with_suffix(".tmp.npz")
+    np.savez_compressed(tmp, **features)
+    os.replace(tmp, output_path)
+    return len(audio.wave) / audio.SR, time.perf_counter() - st
+
+
+def load_manifest(out_dir):
+    path = Path(out_dir) / MANIFEST
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(out_dir, manifest):
+    path = Path(out_dir) / MANIFEST
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def is_done(entry, audio_path, output_path, spectrogram):
+    """Whether the manifest `entry` says `audio_path` (as it is now) was already written to `output_path` in this format"""
+    if entry is None or not output_path.exists():
+        return False
+    if entry.get("spectrogram") != spectrogram:
+        return False
+    stat = audio_path.stat()
+    return entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("directory", nargs="?", default="data")
+    parser.add_argument("--out", default="features", help="output directory")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="number of processes"
+    )
+    parser.add_argument(
+        "--spectrogram",
+        choices=["mel", "full"],
+        default="mel",
+        help="store a log mel spectrogram or the full log amplitude spectrogram",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="reprocess files that are already done"
+    )
+    args = parser.parse_args()
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest = {} if args.force else load_manifest(out_dir)
+
+    jobs = {}
+    for audio_path in find_audio_files(args.directory):
+        name = audio_path.relative_to(args.directory).as_posix()
+        output_path = out_dir / f"{name}.npz"
+        if is_done(manifest.get(name), audio_path, output_path, args.spectrogram):
+            print(f"{name}: already done")
+            continue
+        jobs[name] = (audio_path, output_path)
+    if not jobs:
+        print("nothing to do")
+        return
+
+    total_audio = 0.0
+    failed = 0
+    st = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(
+                analyze_file, audio_path, output_path, args.spectrogram
+            ): name
+            for name, (audio_path, output_path) in jobs.items()
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            audio_path, output_path = jobs[name]
+            try:
+                audio_sec, elapsed = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"{name}: failed ({e!r})")
+                continue
+            total_audio += audio_sec
+            stat = audio_path.stat()
+            manifest[name] = {
+                "output": output_path.relative_to(out_dir).as_posix(),
+                "spectrogram": args.spectrogram,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "audio_sec": audio_sec,
+                "elapsed_sec": elapsed,
+            }
+            # 1 ファイル終わるたびに保存して，中断しても再開できるようにする
+            save_manifest(out_dir, manifest)
+            print(
+                f"{name}: {audio_sec:.1f} s of audio in {elapsed:.2f} s"
+                f" ({audio_sec / elapsed:.1f}x realtime)"
+            )
+    wall = time.perf_counter() - st
+
+    print(
+        f"total: {len(jobs) - failed} files, {total_audio:.1f} s of audio in {wall:.2f} s"
+        f" with {args.workers} workers ({total_audio / wall:.1f} audio-sec / wall-sec)"
+    )
+    if failed:
+        raise SystemExit(f"{failed} files failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Per-chunk latency of decoding a paInt16 microphone chunk, before (wave file + librosa.load) and after (decode_pcm16).
+
+    python app/bench_decode.py [n_chunks]
+"""
+
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+
+import librosa
+import numpy as np
+
+from audio_io import decode_pcm16
+
+CHANNELS = 2
+SAMPLE_WIDTH = 2  # paInt16
+FR = 16000
+CHUNKS = 1024
+
+
+def decode_via_file(frame, path):
+    """The old path of karaoke_app.MainWidget.handle_recorded"""
+    wf = wave.open(str(path), "wb")
+    wf.setnchannels(CHANNELS)
+    wf.setsampwidth(SAMPLE_WIDTH)
+    wf.setframerate(FR)
+    wf.writeframes(frame)
+    wf.close()
+    x, _ = librosa.load(str(path))
+    return x
+
+
+def measure(decode, frames):
+    """Return per-chunk latencies [msec] of `decode` over `frames`"""
+    latencies = np.empty(len(frames))
+    for i, frame in enumerate(frames):
+        st = time.perf_counter()
+        decode(i, frame)
+        latencies[i] = (time.perf_counter() - st) * 1000
+    return latencies
+
+
+def report(name, latencies):
+    print(
+        f"{name:>14}: mean {latencies.mean():8.3f} ms"
+        f"  p50 {np.percentile(latencies, 50):8.3f} ms"
+        f"  p95 {np.percentile(latencies, 95):8.3f} ms"
+        f"  max {latencies.max():8.3f} ms"
+    )
+
+
+def main(n_chunks=200):
+    rng = np.random.default_rng(0)
+    frames = [
+        rng.integers(-(2 ** 15), 2 ** 15, CHUNKS * CHANNELS, dtype=np.int16).tobytes()
+        for _ in range(n_chunks)
+    ]
+    print(f"{n_chunks} chunks of {CHUNKS} samples x {CHANNELS} channels")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before = measure(
+            lambda i, frame: decode_via_file(frame, Path(tmp) / f"recorded{i}.wav"),
+            frames,
+        )
+    after = measure(lambda i, frame: decode_pcm16(frame, CHANNELS), frames)
+
+    report("file + librosa", before)
+    report("decode_pcm16", after)
+    print(f"speedup: {before.mean() / after.mean():.0f}x")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
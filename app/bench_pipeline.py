@@ -0,0 +1,60 @@
+"""
+Throughput and latency of the realtime analysis chain (AudioSource -> CaptureEngine -> LiveAnalyzer), without a microphone or GUI.
+
+    python app/bench_pipeline.py --source synth --fast
+    python app/bench_pipeline.py --source file --input data/aiueo.wav
+"""
+
+import argparse
+import time
+
+from analyze import LiveAnalyzer
+from capture import CaptureEngine
+from instrument import Instrumentation
+from sources import add_source_arguments, source_from_args
+
+SR = 16000
+CHUNKS = 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_source_arguments(parser)
+    parser.set_defaults(source="synth")
+    parser.add_argument(
+        "--instrument", action="store_true", help="print per-stage latencies"
+    )
+    args = parser.parse_args()
+    if args.source == "mic":
+        parser.error("bench_pipeline needs a file or synth source")
+
+    source = source_from_args(args, SR, CHUNKS)
+    instrument = Instrumentation(enabled=args.instrument)
+    live = LiveAnalyzer(SR, CHUNKS, instrument=instrument)
+    # 速度優先で再生するときは取りこぼさないよう，キューが空くまでソースを待たせる
+    engine = CaptureEngine(live.process, source, block=args.fast, instrument=instrument)
+
+    st = time.perf_counter()
+    engine.start()
+    engine.join()
+    elapsed = time.perf_counter() - st
+    engine.stop()
+
+    audio_sec = engine.processed * CHUNKS / SR
+    latencies = engine.latencies.latest()
+    print(f"chunks: {engine.processed} processed, {engine.dropped} dropped")
+    print(
+        f"throughput: {audio_sec:.2f} s of audio in {elapsed:.2f} s"
+        f" ({audio_sec / elapsed:.1f}x realtime)"
+    )
+    print(
+        f"latency (last {len(latencies)} chunks):"
+        f" mean {latencies.mean() * 1000:.3f} ms, max {latencies.max() * 1000:.3f} ms"
+    )
+
+    if args.instrument:
+        print(instrument.summary())
+
+
+if __name__ == "__main__":
+    main()
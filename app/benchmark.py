@@ -0,0 +1,296 @@
+"""
+Benchmarks of the DSP kernels in analyze.py and examples/, with regression checks against a stored baseline.
+
+    python app/benchmark.py --output bench_baseline.json      # run and store the results
+    python app/benchmark.py --baseline bench_baseline.json    # exit with 1 if a kernel got slower
+
+Timings depend on the machine, so no baseline is committed: store one with `--output` on the machine you
+measure on (e.g. from the commit before a change) and compare later runs on that machine against it.
+
+Every kernel runs on synthetic signals (sums of `generate_sinusoid`) of several lengths and on the files in data/.
+For each run, the best and median time over `--repeat` runs, the throughput in audio seconds per second and the
+peak memory allocated during one run (tracemalloc) are reported.
+"""
+
+import argparse
+import importlib.util
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import librosa
+import numpy as np
+
+from analyze import (
+    AudioAnalyzer,
+    generate_sinusoid,
+    get_f0,
+    get_f0_track,
+    get_frame_features,
+    get_spectrogram,
+    hz2nn,
+    stft,
+)
+from chroma import chroma_vectors
+
+SR = AudioAnalyzer.SR
+FRAME_SIZE = AudioAnalyzer.frame_size
+SHIFT_SIZE = AudioAnalyzer.shift_size
+CHUNK = 1024  # karaoke_app で 1 回に F0 を求めるサンプル数
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Python のループで書かれたカーネルは入力をこの長さ [sec] までに切り詰める
+MAX_LOOP_SECONDS = 30
+
+# 計測のばらつきで誤検出しないよう，これより小さい差は回帰とみなさない
+ABS_TOLERANCE = {"time_min": 1e-4, "peak_mib": 0.5}
+
+
+def load_example(name):
+    """Import examples/<name>.py (the examples are not a package)"""
+    spec = importlib.util.spec_from_file_location(
+        f"examples_{name}", ROOT / "examples" / f"{name}.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _chunks(wave):
+    return [wave[i : i + CHUNK] for i in range(0, len(wave) - CHUNK + 1, CHUNK)]
+
+
+class Kernel:
+    """
+    A benchmarked function. `prepare(wave, path)` does the untimed setup (framing, spectra, ...) for an input and
+    returns the function to time; `loop` marks pure Python kernels whose input is truncated to MAX_LOOP_SECONDS.
+    """
+
+    def __init__(self, name, prepare, loop=False):
+        self.name = name
+        self.prepare = prepare
+        self.loop = loop
+
+
+def _audio_analyzer(wave, path):
+    if path is None:
+        return None  # ファイルからしか作れない
+    return lambda: AudioAnalyzer(str(path))
+
+
+def _chroma_vectors(wave, path):
+    spectrogram = stft(wave, FRAME_SIZE, SHIFT_SIZE)
+    return lambda: chroma_vectors(spectrogram, SR, FRAME_SIZE)
+
+
+def _example_chroma(wave, path):
+    chroma = load_example("chroma")
+    spectrogram = stft(wave, FRAME_SIZE, SHIFT_SIZE)
+    frequencies = np.linspace(
+        SR / 2 / spectrogram.shape[1], SR / 2, spectrogram.shape[1]
+    )
+    amplitudes = np.exp(spectrogram)
+    return lambda: [chroma.chroma_vector(a, frequencies) for a in amplitudes]
+
+
+def _example_cepstrum(wave, path):
+    cepstrum = load_example("cepstrum")
+    amplitudes = np.exp(stft(wave, FRAME_SIZE, SHIFT_SIZE))
+    return lambda: [cepstrum.cepstrum(a) for a in amplitudes]
+
+
+def _example_zero_cross(wave, path):
+    zero_cross = load_example("zero_cross")
+    return lambda: zero_cross.zero_cross(wave)
+
+
+def _hz2nn(wave, path):
+    f0s = get_f0_track(wave, SR)
+    f0s = f0s[f0s > 0]
+    return lambda: [hz2nn(f0) for f0 in f0s]
+
+
+KERNELS = [
+    Kernel(
+        "get_spectrogram",
+        lambda wave, path: lambda: get_spectrogram(wave, SR, FRAME_SIZE),
+    ),
+    Kernel("AudioAnalyzer", _audio_analyzer),
+    Kernel(
+        "get_f0 (per chunk)",
+        lambda wave, path: lambda: [get_f0(x, SR) for x in _chunks(wave)],
+    ),
+    Kernel("get_f0_track", lambda wave, path: lambda: get_f0_track(wave, SR)),
+    Kernel("hz2nn", _hz2nn),
+    Kernel(
+        "get_frame_features",
+        lambda wave, path: lambda: get_frame_features(wave, SR, FRAME_SIZE, SHIFT_SIZE),
+    ),
+    Kernel("chroma_vectors", _chroma_vectors),
+    Kernel("examples.zero_cross", _example_zero_cross, loop=True),
+    Kernel("examples.chroma_vector", _example_chroma, loop=True),
+    Kernel("examples.cepstrum", _example_cepstrum, loop=True),
+]
+
+
+def synthetic_inputs(lengths):
+    """(name, wave, None) of a chord-like sum of sinusoids for each length [sec]"""
+    for length in lengths:
+        wave = sum(generate_sinusoid(SR, f, length) for f in (220.0, 277.2, 329.6)) / 3
+        yield f"synth {length:g}s", wave.astype(np.float32), None
+
+
+def file_inputs(directory):
+    for path in sorted(Path(directory).iterdir()):
+        if path.suffix.lower() in (".wav", ".mp3"):
+            yield path.name, librosa.load(str(path), sr=SR)[0], path
+
+
+def measure(fn, repeat):
+    """Return (times [sec] of `repeat` runs, peak memory [bytes] of a separate traced run)"""
+    times = []
+    for _ in range(repeat):
+        st = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - st)
+    # tracemalloc は遅くなるので時間の計測とは別に 1 回だけ動かす
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return times, peak
+
+
+def run(kernels, inputs, repeat):
+    results = []
+    for input_name, wave, path in inputs:
+        for kernel in kernels:
+            x, source = wave, path
+            if kernel.loop:
+                x = wave[: MAX_LOOP_SECONDS * SR]
+                if len(x) < len(wave):
+                    source = None  # 切り詰めた入力はファイルとは別物
+            result = {
+                "kernel": kernel.name,
+                "input": input_name,
+                "audio_sec": len(x) / SR,
+            }
+            try:
+                fn = kernel.prepare(x, source)
+                if fn is None:
+                    continue
+                times, peak = measure(fn, repeat)
+            except Exception as e:
+                # examples の chroma_vector は存在しない math.abs を呼ぶので，失敗も結果として残す
+                result["error"] = f"{type(e).__name__}: {e}"
+                print(
+                    f"{kernel.name:>24} | {input_name:<28} | error: {result['error']}"
+                )
+                results.append(result)
+                continue
+            result.update(
+                time_min=min(times),
+                time_median=float(np.median(times)),
+                throughput=result["audio_sec"] / min(times),
+                peak_mib=peak / 2 ** 20,
+            )
+            print(
+                f"{kernel.name:>24} | {input_name:<28} | {result['time_min'] * 1000:10.2f} ms"
+                f" | {result['throughput']:10.1f}x realtime | {result['peak_mib']:8.1f} MiB"
+            )
+            results.append(result)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return the messages for results slower (or using more memory) than `baseline` by more than `threshold`"""
+    reference = {(r["kernel"], r["input"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        base = reference.get((r["kernel"], r["input"]))
+        if base is None or "error" in r or "error" in base:
+            continue
+        for key, unit in (("time_min", "s"), ("peak_mib", "MiB")):
+            if (
+                r[key] > base[key] * (1 + threshold)
+                and r[key] - base[key] > ABS_TOLERANCE[key]
+            ):
+                regressions.append(
+                    f"{r['kernel']} on {r['input']}: {key} {base[key]:.4g} {unit} -> {r[key]:.4g} {unit}"
+                    f" (+{(r[key] / max(base[key], 1e-12) - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--lengths",
+        type=float,
+        nargs="+",
+        default=[1, 10, 60],
+        help="lengths [sec] of the synthetic signals",
+    )
+    parser.add_argument(
+        "--data", default=str(ROOT / "data"), help="directory of audio files"
+    )
+    parser.add_argument("--no-files", action="store_true", help="only synthetic inputs")
+    parser.add_argument(
+        "--kernels",
+        nargs="+",
+        help="run only the kernels whose name contains one of these",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--output", help="write the results to this JSON file (e.g. as a baseline)"
+    )
+    parser.add_argument("--baseline", help="JSON file of results to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="allowed relative slowdown against the baseline (0.25 = 25%%)",
+    )
+    args = parser.parse_args()
+    if args.baseline and not Path(args.baseline).exists():
+        parser.error(f"{args.baseline} does not exist; write a baseline with --output")
+
+    kernels = KERNELS
+    if args.kernels:
+        kernels = [k for k in KERNELS if any(s in k.name for s in args.kernels)]
+    inputs = list(synthetic_inputs(args.lengths))
+    if not args.no_files:
+        inputs += list(file_inputs(args.data))
+
+    report = {
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": run(kernels, inputs, args.repeat),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report["results"], baseline, args.threshold)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"no regression beyond {args.threshold * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+# ArrayWriter が大きさを変えるときに一度にコピーする行数
+COPY_BLOCK_ROWS = 4096
+
+
+class FeatureCache:
+    """
+    On-disk cache of decoded waveforms and computed features, stored as .npy files and opened memory-mapped.
+
+    Each entry is a directory named after the content hash of the audio file and the analysis parameters, so
+    editing the file or changing a parameter never returns stale features. When the cache grows beyond
+    `max_bytes`, the least recently used entries are removed.
+    """
+
+    def __init__(self, directory="cache", max_bytes=1024 ** 3):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def file_hash(path):
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def key(self, audio_path, **params):
+        """Cache key for `audio_path` analyzed with `params` (e.g. sr, frame_size, shift_size, window)"""
+        desc = ",".join(f"{k}={params[k]}" for k in sorted(params))
+        digest = hashlib.sha1(desc.encode()).hexdigest()[:12]
+        return f"{self.file_hash(audio_path)[:20]}-{digest}"
+
+    def load(self, key, name):
+        """Return the cached array `name` of entry `key` memory-mapped read-only, or None"""
+        path = self.directory / key / f"{name}.npy"
+        if not path.exists():
+            return None
+        os.utime(path.parent)  # LRU のために最終アクセス時刻を更新
+        return np.load(path, mmap_mode="r")
+
+    def save(self, key, name, array):
+        entry = self.directory / key
+        entry.mkdir(exist_ok=True)
+        tmp = entry / f"{name}.tmp.npy"
+        np.save(tmp, np.asarray(array))
+        self._commit(key, name, tmp)
+
+    def writer(self, key, name, capacity, row_shape=(), dtype=np.float32):
+        """An ArrayWriter that fills `name` of entry `key` in place, row block by row block"""
+        return ArrayWriter(capacity, row_shape, dtype, self, key, name)
+
+    def _commit(self, key, name, tmp):
+        entry = self.directory / key
+        os.replace(tmp, entry / f"{name}.npy")  # 書き込み途中のファイルを読まないように
+        os.utime(entry)
+        self.evict(keep=key)
+
+    def get_or_compute(self, key, name, compute):
+        """Load `name` from entry `key`, computing and storing it with `compute()` on a miss"""
+        array = self.load(key, name)
+        if array is None:
+            self.save(key, name, compute())
+            array = self.load(key, name)
+        return array
+
+    def evict(self, keep=None):
+        """Remove least recently used entries (except `keep`) until the cache fits in `max_bytes`"""
+        entries = []
+        for entry in self.directory.iterdir():
+            if entry.is_dir():
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                entries.append((entry.stat().st_mtime, size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entry.name == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+class ArrayWriter:
+    """
+    Appends rows to an array allocated up front for `capacity` rows: a writable .npy memmap in entry `key` of
+    `cache`, or an ndarray without a cache, so filling it never holds more than the rows being appended in
+    anonymous memory. More rows than expected make it grow by copying. `finish()` returns the rows written,
+    memory-mapped read-only from the cache (which then holds them as `name`) if there is one.
+    """
+
+    def __init__(
+        self, capacity, row_shape=(), dtype=np.float32, cache=None, key=None, name=None
+    ):
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.cache = cache
+        self.key = key
+        self.name = name
+        self.n = 0  # 書き込んだ行数
+        self._path = None
+        self._files = 0
+        self.array = self._allocate(capacity)
+
+    @property
+    def filled(self):
+        """The rows written so far"""
+        return self.array[: self.n]
+
+    def append(self, rows):
+        stop = self.n + len(rows)
+        if stop > len(self.array):
+            self._resize(max(stop, len(self.array) * 5 // 4))
+        self.array[self.n : stop] = rows
+        self.n = stop
+
+    def finish(self):
+        if self.cache is None:
+            return self.filled
+        if self.n == 0:
+            self._remove()
+            self.cache.save(self.key, self.name, self.filled)
+        else:
+            if self.n != len(self.array):
+                self._resize(self.n)
+            self.array.flush()
+            self.array = None  # ファイルを置き換える前に閉じる
+            self.cache._commit(self.key, self.name, self._path)
+        return self.cache.load(self.key, self.name)
+
+    def _allocate(self, capacity):
+        shape = (max(capacity, 1),) + self.row_shape  # 長さ 0 のファイルは memmap できない
+        if self.cache is None:
+            return np.empty(shape, dtype=self.dtype)
+        entry = self.cache.directory / self.key
+        entry.mkdir(exist_ok=True)
+        self._files += 1
+        self._path = entry / f"{self.name}.tmp{self._files}.npy"
+        return np.lib.format.open_memmap(
+            self._path, mode="w+", dtype=self.dtype, shape=shape
+        )
+
+    def _resize(self, capacity):
+        old, old_path = self.array, self._path
+        self.array = self._allocate(capacity)
+        for i in range(0, self.n, COPY_BLOCK_ROWS):
+            stop = min(i + COPY_BLOCK_ROWS, self.n)
+            self.array[i:stop] = old[i:stop]
+        del old
+        if old_path is not None:
+            os.remove(old_path)
+
+    def _remove(self):
+        self.array = None
+        if self._path is not None:
+            os.remove(self._path)
+            self._path = None
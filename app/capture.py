@@ -0,0 +1,112 @@
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+
+from instrument import Instrumentation
+from ringbuffer import RingBuffer
+
+logger = logging.getLogger(__file__)
+
+
+class CaptureEngine:
+    """
+    Runs the realtime input pipeline for an `AudioSource` (see sources.py).
+
+    The source's callback only timestamps each raw chunk and pushes it into a bounded queue; a dedicated
+    analysis thread decodes the chunks (`source.decode`) and passes them to `handler(samples)`, so analysis never waits for the UI and the UI never waits
+    for analysis. When the queue is full, chunks are dropped (`block=False`, as a microphone cannot wait) or
+    the source is held back (`block=True`, for replaying files as fast as possible).
+
+    If `clock` is given, every chunk is stamped with `clock()` (e.g. the playback position in samples, -1 if
+    unknown) when it is received, and `positions.get(i)` is the stamp of the i-th chunk passed to `handler`.
+    """
+
+    def __init__(
+        self, handler, source, max_queue=64, block=False, instrument=None, clock=None
+    ):
+        self.handler = handler
+        self.source = source
+        self.block = block
+        self.instrument = Instrumentation() if instrument is None else instrument
+        self.clock = clock
+
+        self._queue = queue.Queue(max_queue)
+        self._stop = threading.Event()
+        self._worker = None
+
+        self.captured = 0  # ソースから受け取ったチャンク数
+        self.processed = 0  # handler で処理し終えたチャンク数
+        self.dropped = 0  # キューが一杯で捨てたチャンク数
+        self.latencies = RingBuffer(256, dtype=np.float64)  # 受信から処理完了まで [sec]
+        self.last_captured_at = None  # 最後に処理したチャンクを受信した時刻
+        self.positions = RingBuffer(
+            1024, dtype=np.int64, fill=-1
+        )  # チャンクを受信したときの clock()
+
+    def start(self):
+        self._stop.clear()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+        self.source.start(self._push)
+
+    def stop(self):
+        """Stop the source and the analysis thread"""
+        self.source.stop()
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join()
+            self._worker = None
+
+    def join(self):
+        """Wait until the source has finished and every captured chunk has been processed"""
+        self.source.finished.wait()
+        self._queue.join()
+
+    @property
+    def backlog(self):
+        """Number of chunks waiting for the analysis thread"""
+        return self._queue.qsize()
+
+    def latency_stats(self):
+        """Mean and max end-to-end latency [sec] over the recent chunks"""
+        latencies = self.latencies.latest()
+        if len(latencies) == 0:
+            return {"mean": 0.0, "max": 0.0}
+        return {"mean": float(latencies.mean()), "max": float(latencies.max())}
+
+    def _push(self, data):
+        # ソースのスレッドで呼ばれるので，ここでは重い処理をしない
+        self.captured += 1
+        position = -1 if self.clock is None else self.clock()
+        item = (data, time.perf_counter(), position)
+        if self.block:
+            self._queue.put(item)
+            return
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                data, captured_at, position = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            # handler の結果を読む側が位置を引けるよう，先に書いておく
+            self.positions.write(position)
+            self.instrument.record("queue", time.perf_counter() - captured_at)
+            try:
+                with self.instrument.stage("decode"):
+                    samples = self.source.decode(data)
+                with self.instrument.stage("analysis"):
+                    self.handler(samples)
+            except Exception:
+                logger.exception("failed to analyze a chunk")
+            self.last_captured_at = captured_at
+            self.processed += 1
+            self.latencies.write(time.perf_counter() - captured_at)
+            self._queue.task_done()
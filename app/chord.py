@@ -0,0 +1,169 @@
+"""
+Chord recognition from chroma vectors: 24 major / minor triad templates scored with one matrix product and
+smoothed with an HMM (Viterbi), either over a whole song or incrementally with a fixed lag for live input.
+
+    python app/chord.py data/easy_chords.wav
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from analyze import AudioAnalyzer
+from chroma import PITCH_CLASSES
+
+CHORDS = tuple(PITCH_CLASSES) + tuple(f"{name}m" for name in PITCH_CLASSES)
+
+
+def chord_templates():
+    """(24, 12) unit-norm templates: C, C#, ..., B major, then Cm, C#m, ..., Bm"""
+    templates = np.zeros((24, 12), dtype=np.float32)
+    for root in range(12):
+        templates[root, [root, (root + 4) % 12, (root + 7) % 12]] = 1
+        templates[12 + root, [root, (root + 3) % 12, (root + 7) % 12]] = 1
+    return templates / np.linalg.norm(templates, axis=1, keepdims=True)
+
+
+TEMPLATES = chord_templates()
+
+
+def chord_scores(chroma):
+    """Cosine similarity of each chroma vector (row) to each template, shape (n_frames, 24)"""
+    chroma = np.atleast_2d(np.asarray(chroma, dtype=np.float32))
+    norm = np.linalg.norm(chroma, axis=1, keepdims=True)
+    return (chroma / np.maximum(norm, 1e-10)) @ TEMPLATES.T
+
+
+class ChordModel:
+    """
+    HMM over the 24 chords. The emission log-likelihood of a frame is `sharpness` times its template similarity,
+    and a chord is expected to last `mean_duration` seconds, which with frames every `hop_sec` seconds gives
+    the probability of staying on the same chord from one frame to the next.
+    """
+
+    def __init__(self, hop_sec, mean_duration=1.0, sharpness=20.0):
+        self.hop_sec = hop_sec
+        self.sharpness = sharpness
+        stay = np.exp(-hop_sec / mean_duration)
+        n = len(CHORDS)
+        transition = np.full((n, n), (1 - stay) / (n - 1))
+        np.fill_diagonal(transition, stay)
+        self.log_transition = np.log(transition)  # [前の和音, 次の和音]
+
+    def log_emissions(self, chroma):
+        return self.sharpness * chord_scores(chroma)
+
+    def step(self, log_delta, log_emission):
+        """One Viterbi step: return the new log probabilities and the best previous chord of each chord"""
+        candidates = log_delta[:, None] + self.log_transition
+        back = np.argmax(candidates, axis=0)
+        log_delta = candidates[back, np.arange(len(back))] + log_emission
+        return log_delta - log_delta.max(), back  # 桁あふれしないよう正規化
+
+
+def estimate_chords(chroma, hop_sec, mean_duration=1.0, sharpness=20.0):
+    """Most likely chord index (into CHORDS) for every frame of `chroma`, decoded over the whole sequence"""
+    model = ChordModel(hop_sec, mean_duration, sharpness)
+    emissions = model.log_emissions(chroma)
+    n_frames = len(emissions)
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.int64)
+    backs = np.empty((n_frames, len(CHORDS)), dtype=np.int64)
+    log_delta = emissions[0] - emissions[0].max()
+    for t in range(1, n_frames):
+        log_delta, backs[t] = model.step(log_delta, emissions[t])
+    path = np.empty(n_frames, dtype=np.int64)
+    path[-1] = np.argmax(log_delta)
+    for t in range(n_frames - 1, 0, -1):
+        path[t - 1] = backs[t, path[t]]
+    return path
+
+
+class ChordTracker:
+    """
+    Fixed-lag Viterbi for live input: `push(chroma)` takes the next chroma vector and returns the chord of the
+    frame `lag` frames before it (None until that many frames have been seen), decided with the evidence of the
+    `lag` frames that follow it. Memory and time per frame are bounded by `lag`.
+    """
+
+    def __init__(self, hop_sec, lag=8, mean_duration=1.0, sharpness=20.0):
+        if lag < 1:
+            raise ValueError("lag must be at least 1")
+        self.model = ChordModel(hop_sec, mean_duration, sharpness)
+        self.lag = lag
+        # 直近 lag フレームの後向きポインタ
+        self._backs = np.zeros((lag, len(CHORDS)), dtype=np.int64)
+        self._log_delta = None
+        self.n_frames = 0
+        self.current = None  # 最後に確定した和音の番号
+
+    @property
+    def latency_sec(self):
+        return self.lag * self.model.hop_sec
+
+    def push(self, chroma):
+        emission = self.model.log_emissions(chroma)[0]
+        if self._log_delta is None:
+            self._log_delta = emission - emission.max()
+        else:
+            self._log_delta, back = self.model.step(self._log_delta, emission)
+            self._backs[self.n_frames % self.lag] = back
+        self.n_frames += 1
+        if self.n_frames <= self.lag:
+            return None
+        # 現在の最尤の和音から lag フレームさかのぼる
+        chord = int(np.argmax(self._log_delta))
+        for t in range(self.n_frames - 1, self.n_frames - 1 - self.lag, -1):
+            chord = int(self._backs[t % self.lag, chord])
+        self.current = chord
+        return chord
+
+
+def chord_segments(path, hop_sec):
+    """Group a chord index per frame into (start [sec], end [sec], chord name) segments"""
+    if len(path) == 0:
+        return []
+    changes = np.flatnonzero(np.diff(path)) + 1
+    starts = np.concatenate([[0], changes])
+    ends = np.concatenate([changes, [len(path)]])
+    return [
+        (start * hop_sec, end * hop_sec, CHORDS[path[start]])
+        for start, end in zip(starts, ends)
+    ]
+
+
+def main(audio_path="data/easy_chords.wav"):
+    audio = AudioAnalyzer(audio_path)
+    hop_sec = audio.shift_size / audio.SR
+    chroma = np.asarray(audio.chroma)
+    audio_sec = len(chroma) * hop_sec
+
+    st = time.perf_counter()
+    path = estimate_chords(chroma, hop_sec)
+    offline = time.perf_counter() - st
+    for start, end, name in chord_segments(path, hop_sec):
+        if end - start >= 0.1:
+            print(f"{start:7.2f} - {end:7.2f} s  {name}")
+
+    tracker = ChordTracker(hop_sec)
+    st = time.perf_counter()
+    live = [tracker.push(c) for c in chroma]
+    streaming = time.perf_counter() - st
+    agreement = np.mean(
+        np.array(live[tracker.lag :]) == path[: len(path) - tracker.lag]
+    )
+
+    print(
+        f"offline: {len(chroma)} frames in {offline * 1000:.1f} ms"
+        f" ({audio_sec / offline:.0f}x realtime)"
+    )
+    print(
+        f"streaming: {streaming / len(chroma) * 1e6:.1f} us per frame"
+        f" ({audio_sec / streaming:.0f}x realtime), latency {tracker.latency_sec * 1000:.0f} ms,"
+        f" {agreement * 100:.1f}% of frames same as offline"
+    )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
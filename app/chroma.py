@@ -0,0 +1,39 @@
+from functools import lru_cache
+
+import numpy as np
+import scipy.sparse
+
+# 0 = C, 1 = C#, 2 = D, ..., 11 = B
+PITCH_CLASSES = ("C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B")
+
+
+@lru_cache(maxsize=None)
+def chroma_matrix(sr, frame_size):
+    """
+    Sparse (12, frame_size // 2 + 1) matrix that adds the amplitude of every frequency bin except DC to the pitch
+    class of its nearest note (as examples/chroma.py does bin by bin). Built once per (sr, frame_size).
+    """
+    n_bins = frame_size // 2 + 1
+    bins = np.arange(1, n_bins)
+    frequencies = bins * sr / frame_size
+    pitch_classes = (
+        np.round(12.0 * np.log2(frequencies / 440.0)).astype(int) + 69
+    ) % 12
+    return scipy.sparse.csr_matrix(
+        (np.ones(len(bins), dtype=np.float32), (pitch_classes, bins)),
+        shape=(12, n_bins),
+    )
+
+
+def chroma_vectors(spectrogram, sr, frame_size):
+    """
+    Chroma vectors of every frame of a log amplitude spectrogram as a float32 array of shape (n_frames, 12),
+    computed with one sparse matrix product per block of frames.
+    """
+    from analyze import spectrogram_blocks
+
+    m = chroma_matrix(sr, frame_size)
+    chroma = np.empty((spectrogram.shape[0], 12), dtype=np.float32)
+    for i, block in spectrogram_blocks(spectrogram):
+        chroma[i : i + len(block)] = m.dot(np.exp(block).T).T
+    return chroma
@@ -0,0 +1,128 @@
+import json
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+from ringbuffer import RingBuffer
+
+# 計測する段階 (チャンクが通る順)
+STAGES = (
+    "queue",  # 受信してから解析スレッドが取り出すまで
+    "decode",  # PyAudio のバイト列 -> float32 (解析スレッド)
+    "f0",  # F0・音量・有声判定 (PitchTracker)
+    "spectrum",
+    "chroma",
+    "analysis",  # 1 チャンクの解析全体
+    "render",  # 解析結果をビューに反映する (UI スレッド)
+    "score",  # 歌声の採点 (UI スレッド)
+    "plot",  # Matplotlib の再描画 (UI スレッド)
+    "end_to_end",  # 受信してから画面に反映されるまで
+)
+
+_DISABLED = nullcontext()
+
+
+class _Timer:
+    __slots__ = ("ring", "start")
+
+    def __init__(self, ring):
+        self.ring = ring
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.ring.write(time.perf_counter() - self.start)
+        return False
+
+
+class Instrumentation:
+    """
+    Per-stage timings of the realtime pipeline, kept as rolling windows of the last `history` samples.
+
+    Code under measurement wraps a stage in `with instrument.stage("f0"): ...` or calls `record(stage, seconds)`.
+    While `enabled` is False, `stage` returns a shared no-op context manager and `record` returns at once, so
+    the hooks can stay in the hot path. Each stage is written by a single thread (see STAGES), as the
+    underlying RingBuffers require.
+    """
+
+    def __init__(self, enabled=False, history=1024):
+        self.enabled = enabled
+        self.timings = {
+            stage: RingBuffer(history, dtype=np.float64) for stage in STAGES
+        }
+        self.backlog = RingBuffer(history, dtype=np.int64)  # 解析待ちのチャンク数
+        self.counters = {}
+
+    def stage(self, name):
+        if not self.enabled:
+            return _DISABLED
+        return _Timer(self.timings[name])
+
+    def record(self, name, seconds):
+        if self.enabled:
+            self.timings[name].write(seconds)
+
+    def record_backlog(self, n):
+        if self.enabled:
+            self.backlog.write(n)
+
+    def stats(self):
+        """p50 / p95 / p99 / max [msec] and sample count of every stage measured so far"""
+        stats = {}
+        for stage, ring in self.timings.items():
+            times = ring.latest() * 1000
+            if len(times) == 0:
+                continue
+            p50, p95, p99 = np.percentile(times, [50, 95, 99])
+            stats[stage] = {
+                "count": ring.total_written,
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": float(times.max()),
+            }
+        backlog = self.backlog.latest()
+        if len(backlog) > 0:
+            stats["backlog"] = {
+                "current": int(backlog[-1]),
+                "max": int(backlog.max()),
+                "mean": float(backlog.mean()),
+            }
+        return stats
+
+    def summary(self):
+        """The stats as lines of text for an on-screen overlay"""
+        lines = [f"{'stage':>10}  {'p50':>7}  {'p95':>7}  {'p99':>7}  {'max':>7} [ms]"]
+        stats = self.stats()
+        for stage in STAGES:
+            if stage in stats:
+                s = stats[stage]
+                lines.append(
+                    f"{stage:>10}  {s['p50_ms']:7.2f}  {s['p95_ms']:7.2f}"
+                    f"  {s['p99_ms']:7.2f}  {s['max_ms']:7.2f}"
+                )
+        if "backlog" in stats:
+            b = stats["backlog"]
+            lines.append(f"backlog: {b['current']} chunks (max {b['max']})")
+        lines += [f"{name}: {value}" for name, value in self.counters.items()]
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """Write the stats, counters and raw recent timings [sec] to a JSON file"""
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "stats": self.stats(),
+                    "counters": self.counters,
+                    "timings": {
+                        stage: ring.latest().tolist()
+                        for stage, ring in self.timings.items()
+                    },
+                    "backlog": self.backlog.latest().tolist(),
+                },
+                f,
+                indent=2,
+            )
@@ -1,36 +1,43 @@
 from __future__ import annotations
 
+import argparse
 import io
 import logging
 import sys
-import threading
-import wave
+import time
 from datetime import datetime
 from functools import partial
-from pathlib import Path
 from random import random
 
-import cv2
-import librosa
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
-import pyaudio
 from kivy.app import App
 from kivy.clock import Clock
 from kivy.core.audio import SoundLoader
 from kivy.core.image import Image as CoreImage
+from kivy.core.window import Window
 from kivy.garden.matplotlib.backend_kivyagg import FigureCanvasKivyAgg
-from kivy.graphics import Color, Ellipse, Line
-from kivy.properties import ListProperty, ObjectProperty
+from kivy.graphics import Color, Ellipse, Line, Rectangle
+from kivy.graphics.texture import Texture
+from kivy.properties import ObjectProperty
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
 from kivy.uix.image import Image
+from kivy.uix.label import Label
 from kivy.uix.slider import Slider
 from kivy.uix.widget import Widget
-from playsound import playsound
-
-from analyze import AudioAnalyzer, get_f0, get_spectrogram, hz2nn
+from matplotlib import cm
+
+from analyze import AudioAnalyzer, LiveAnalyzer
+from cache import FeatureCache
+from capture import CaptureEngine
+from chord import CHORDS, ChordTracker
+from instrument import Instrumentation
+from playback import start_playback
+from rendering import FigureRenderer
+from scoring import PitchScorer
+from sources import PyAudioSource, add_source_arguments, source_from_args
 
 logger = logging.getLogger(__file__)
 
@@ -44,16 +51,14 @@ class AudioView(BoxLayout):
     fig: matplotlib.figure.Figure
 
     def update_fig(self):
-        # self.ax.relim()
-        # self.ax.autoscale_view()
-        self.fig.canvas.draw()
-        self.fig.canvas.flush_events()
+        """Schedule a redraw; only the animated artists are redrawn unless the axis limits changed"""
+        self.renderer.request()
 
 
 class WaveView(AudioView):
     """Shows raw waveform"""
 
-    def init(self, title, *args):
+    def init(self, title, instrument=None, *args):
         self.fig, self.ax = plt.subplots()
         wave = np.zeros(100)
         (self.plot,) = self.ax.plot(np.arange(wave.shape[0]), wave)
@@ -61,6 +66,7 @@ class WaveView(AudioView):
         self.ax.set_xlabel("Sample")
         widget = FigureCanvasKivyAgg(self.fig)
         self.add_widget(widget)
+        self.renderer = FigureRenderer(self.fig, widget, [self.plot], instrument)
 
     def update_view(self, wave, ymin=None, ymax=None, *args, **kwargs):
         if len(wave) == 0:
@@ -77,149 +83,381 @@ class WaveView(AudioView):
         self.update_fig()
 
 
-class SpectrogramView(AudioView):
-    def init(self, spectrogram, sr, *args):
-        spec = spectrogram[:, : spectrogram.shape[1] // 5]
-        h, w = spec.T.shape
-        img = cv2.resize(spec.T, (w // 3, h // 2))
-        print(img.shape)
-        self.max_hz = sr / 2 // 5
+class ScrollingTexture:
+    """
+    Fixed-width ring of spectrogram columns kept in a Kivy texture.
+    New columns overwrite the oldest ones in place (only that region is uploaded), and the ring is shown as two rectangles split at the write position, so the cost per frame does not depend on the length of the song.
+    """
+
+    def __init__(self, width, height, vmin, vmax, cmap="viridis"):
+        self.width = width
+        self.height = height
+        self.vmin = vmin
+        self.vmax = vmax
+        self.lut = (cm.get_cmap(cmap)(np.linspace(0, 1, 256)) * 255).astype(np.uint8)
+
+        self.texture = Texture.create(size=(width, height), colorfmt="rgba")
+        self.texture.mag_filter = "nearest"
+        self.clear()
+        self.rects = []
+
+    def clear(self):
+        """Erase all columns"""
+        self._blit(np.zeros((self.height, self.width, 4), dtype=np.uint8), 0)
+        self.written = 0
+
+    def draw(self, canvas):
+        """Add the rectangles showing this texture to `canvas`"""
+        with canvas:
+            self.rects = [Rectangle(texture=self.texture) for _ in range(2)]
+
+    def place(self, pos, size):
+        """Lay out the columns from oldest (left) to newest (right) in the given area"""
+        x, y = pos
+        w, h = size
+        p = self.written % self.width
+        old = (self.width - p) / self.width  # 古い側 [p, width) が占める割合
+        u = p / self.width
+        self.rects[0].pos = (x, y)
+        self.rects[0].size = (w * old, h)
+        self.rects[0].tex_coords = [u, 0, 1, 0, 1, 1, u, 1]
+        self.rects[1].pos = (x + w * old, y)
+        self.rects[1].size = (w * (1 - old), h)
+        self.rects[1].tex_coords = [0, 0, u, 0, u, 1, 0, 1]
+
+    def append(self, columns):
+        """Append spectra (rows of `columns`, low frequency first) as the newest columns"""
+        n = len(columns)
+        columns = columns[-self.width :]
+        scaled = (np.asarray(columns) - self.vmin) * (255 / (self.vmax - self.vmin))
+        idx = np.nan_to_num(scaled, nan=0, posinf=255, neginf=0).clip(0, 255)
+        rgba = self.lut[idx.astype(np.uint8).T]  # (height, 列数, 4)
+
+        pos = (self.written + n - len(columns)) % self.width
+        first = min(len(columns), self.width - pos)
+        self._blit(rgba[:, :first], pos)
+        if first < len(columns):
+            self._blit(rgba[:, first:], 0)
+        self.written += n
+
+    def _blit(self, rgba, x):
+        self.texture.blit_buffer(
+            np.ascontiguousarray(rgba).tobytes(),
+            size=(rgba.shape[1], rgba.shape[0]),
+            pos=(x, 0),
+            colorfmt="rgba",
+            bufferfmt="ubyte",
+        )
+
+
+class SpectrogramView(Widget):
+    """Scrolling spectrograms of the song (top) and the microphone input (bottom) over the last few seconds"""
 
+    SECONDS = 5
+
+    def init(self, spectrogram, sr, mic_columns_per_sec):
+        self.spectrogram = spectrogram
+        self.n_bins = spectrogram.shape[1] // 5
+        self.max_hz = sr / 2 // 5
         print(f"max_hz: {self.max_hz}")
 
-        self.fig, self.ax = plt.subplots()
-        self.im = self.ax.imshow(
-            np.flipud(img),
-            extent=[0, spectrogram.shape[0] / 100, 0, self.max_hz],
-            aspect="auto",
-            interpolation="nearest",
-        )
-        self.ax.set_title("Spectrogram")
-        self.ax.set_xlabel("Sample")
-        self.ax.set_ylabel("frequency [Hz]")
-        # self.ax.set_ylim(0, 1000)
-        # self.ax.set_xlim(0, 10)
-        widget = FigureCanvasKivyAgg(self.fig)
-        self.add_widget(widget)
+        # 色の範囲は曲全体から間引いたフレームで決める (log(0) = -inf は除く)
+        step = max(1, len(spectrogram) // 200)
+        sample = np.asarray(spectrogram[::step, : self.n_bins])
+        vmin, vmax = np.percentile(sample[np.isfinite(sample)], [5, 99.9])
 
-    def update_view(self, sec):
-        self.ax.set_xlim(sec - 5, sec)
-        self.update_fig()
+        self.song = ScrollingTexture(self.SECONDS * 100, self.n_bins, vmin, vmax)
+        self.mic = ScrollingTexture(
+            int(self.SECONDS * mic_columns_per_sec), self.n_bins, vmin, vmax
+        )
+        self.song_frame = 0
+        self.song.draw(self.canvas)
+        self.mic.draw(self.canvas)
+        self.label = Label(halign="left", valign="top")
+        self.add_widget(self.label)
+        self.bind(pos=self._layout, size=self._layout)
+        self._layout()
+
+    def _layout(self, *args):
+        w, h = self.size
+        self.song.place((self.x, self.y + h / 2), (w, h / 2))
+        self.mic.place(self.pos, (w, h / 2))
+        self.label.pos = self.pos
+        self.label.size = self.size
+        self.label.text_size = self.size
+
+    def update_view(self, sec, mic_spectra, chord=None, score=None, note_score=None):
+        """Scroll the song to `sec` (10 msec per frame), append the new microphone spectra and show the chord being played and the singer's scores"""
+        frame = min(int(sec * 100), len(self.spectrogram))
+        if frame < self.song_frame:
+            # 巻き戻したら消して，表示幅の分から描き直す
+            self.song.clear()
+            self.song_frame = max(frame - self.song.width, 0)
+        if frame > self.song_frame:
+            # 表示幅より先に進んだ分は描かずに飛ばす
+            start = max(self.song_frame, frame - self.song.width)
+            self.song.written += start - self.song_frame
+            self.song.append(self.spectrogram[start:frame, : self.n_bins])
+            self.song_frame = frame
+        if len(mic_spectra) > 0:
+            self.mic.append(mic_spectra[:, : self.n_bins])
+        self._layout()
+        self.label.text = f"song / mic  {sec:.1f} s  (0 - {self.max_hz:.0f} Hz)"
+        if chord is not None:
+            self.label.text += f"\nchord: {chord}"
+        if score is not None:
+            self.label.text += f"\nscore: {score:.1f}"
+            if note_score is not None:
+                self.label.text += f"  (note: {note_score:.0f})"
 
 
 class MainWidget(BoxLayout):
     spectrogram_view = ObjectProperty(None)
     db_view = ObjectProperty(None)
     f0_view = ObjectProperty(None)
-    frames = ListProperty(list())
 
-    CHANNELS = 1
-    FORMAT = pyaudio.paInt16
-    FR = 16000  # Frame Rate = Sample Rate * Channels
-    SR = FR // CHANNELS
+    CHANNELS = 2
+    FR = 16000  # Frame Rate (PyAudio の rate はチャンネルあたりのサンプル数)
+    SR = FR
     CHUNKS = 1024
     SHOW_SAMPLES = 12000
-
-    def __init__(self, **kwargs):
+    HISTORY = 60  # F0 / dB の表示フレーム数
+    DB_THRESHOLD = -7.6  # これより小さい音は無声とみなす
+    MAX_PITCH_LATENCY = 0.15  # F0 の平滑化のために待つ最大の時間 [sec]
+    CHORD_LAG = 4  # 和音を確定するまでに待つチャンク数
+    SEEK_SEC = 5  # ← / → キーで戻る・進む時間
+
+    def __init__(
+        self,
+        source=None,
+        instrument=None,
+        instrument_path=None,
+        silent=False,
+        **kwargs,
+    ):
         super().__init__(**kwargs)
-
-        self.pyaudio = pyaudio.PyAudio()
-        self.stream = self.pyaudio.open(
-            format=self.FORMAT,
-            channels=2,
-            rate=self.FR,
-            input=True,
-            frames_per_buffer=self.CHUNKS,
+        # 計測は無効なら何もしないので常に渡しておき，i キーで有効にできるようにする
+        self.instrument = Instrumentation() if instrument is None else instrument
+        self.instrument_path = instrument_path
+        self._always_measure = self.instrument.enabled
+        self.overlay = Label(
+            size_hint=(None, None),
+            halign="left",
+            valign="top",
+            font_name="RobotoMono-Regular",
+            font_size="12sp",
         )
+        self.overlay.bind(texture_size=self.overlay.setter("size"))
+        self._overlay_event = None
+        self._last_captured_at = None
+        Window.bind(on_key_down=self.on_key_down)
 
         audio_path = "data/not-anyone-else-mono.mp3"
 
-        self.music, _ = librosa.load(audio_path, sr=self.SR)
-        play_thread = threading.Thread(
-            target=self.play_music, args=(audio_path,), daemon=True
-        )
-        play_thread.start()
-
+        music = AudioAnalyzer(audio_path, cache=FeatureCache())
+        self.music = music.wave
+        # 曲の参照ピッチはキャッシュにあれば読むだけ
+        self.scorer = PitchScorer.from_audio(music)
+        self._pitch_frames = 0  # 採点した (または読む前に上書きされた) F0 のフレーム数
         print(len(self.music))
-        spectrogram = get_spectrogram(self.music, self.SR, 4096)
-        self.spectrogram_view.init(spectrogram, self.SR)
-
-        self.db_view.init("Decibel")
-        self.f0_view.init("F0")
-
-        self.frames = list()
-        self.recorded = list()
-        self.f0s = list()
-        self.nns = list()
-        self.dbs = list()
-        record_thread = threading.Thread(
-            target=self.record, args=(self.frames,), daemon=True
+        self.spectrogram_view.init(music.spectrogram, self.SR, self.SR / self.CHUNKS)
+
+        self.db_view.init("Decibel", self.instrument)
+        self.f0_view.init("F0", self.instrument)
+
+        self.live = LiveAnalyzer(
+            self.SR,
+            self.CHUNKS,
+            window=self.SHOW_SAMPLES,
+            history=self.HISTORY,
+            instrument=self.instrument,
+            max_latency=self.MAX_PITCH_LATENCY,
+            db_threshold=self.DB_THRESHOLD,
+        )
+        if source is None:
+            source = PyAudioSource(self.FR, self.CHUNKS, self.CHANNELS)
+        self.capture = CaptureEngine(
+            self.live.process,
+            source,
+            instrument=self.instrument,
+            clock=self.song_position,
         )
-        record_thread.start()
-        self.tick = 0
+        self.chords = ChordTracker(self.CHUNKS / self.SR, lag=self.CHORD_LAG)
+        # 曲はデコード済みの波形をメモリから再生し，その位置を時計にする
+        # (出力デバイスがなければ音を出さずにサンプル数だけ数える)
+        self.playback = start_playback(self.music, self.SR, self.CHUNKS, silent)
+        self.capture.start()
         Clock.schedule_interval(self.handle_recorded, 1 / 60)
 
-    def play_music(self, music_path):
-        playsound(music_path)
+    def song_position(self):
+        """Sample of the song being played now, or -1 while paused (called from the capture thread)"""
+        return -1 if self.playback.paused else self.playback.position
 
-    def record(self, frames):
-        st = datetime.now()
-        while True:
-            frame = self.stream.read(self.CHUNKS)
-            logger.debug(len(frames), datetime.now() - st)
-            frames.append(frame)
-            st = datetime.now()
+    def stop(self):
+        self.capture.stop()
+        self.playback.stop()
+        if self.instrument_path is not None:
+            self.dump_instrument(self.instrument_path)
 
     def handle_recorded(self, *args):
-        # logger.debug(f"handle: {self.tick}, {len(self.frames)}")
-        for i in range(self.tick, len(self.frames)):
-            frame = self.frames[i]
-
-            wf = wave.open(f"tmp/recorded{str(i)}.wav", "wb")
-            wf.setnchannels(self.CHANNELS)
-            wf.setsampwidth(self.pyaudio.get_sample_size(self.FORMAT))
-            wf.setframerate(self.FR)
-            wf.writeframes(frame)
-            wf.close()
-
-            x, _ = librosa.load(f"tmp/recorded{str(i)}.wav")
-            self.recorded.extend(x)
-            if len(self.recorded) >= self.SHOW_SAMPLES * 2:
-                self.recorded = self.recorded[-self.SHOW_SAMPLES :]
-
-            N = self.CHUNKS * 1
-            if len(self.recorded) > N:
-                f0 = get_f0(self.recorded[-self.CHUNKS :], self.SR)
-                self.f0s.append(hz2nn(f0) if f0 > 0 else 0)
-                if len(self.f0s) >= 60:
-                    self.f0s = self.f0s[-60:]
-
-                self.dbs.append(
-                    np.log(np.sqrt(np.sum(np.power(self.recorded[-N:], 2)) / N))
-                )
-                if len(self.dbs) > 60:
-                    self.dbs = self.dbs[-60:]
-
-            DB_THRESHOLD = -7.6
-
-            self.db_view.update_view(self.dbs, -9, -1)
-            self.f0_view.update_view(
-                np.array(self.f0s) * (np.array(self.dbs) > DB_THRESHOLD), 20, 80
+        """Redraw the latest results published by the analysis thread"""
+        logger.debug(
+            "handle: %d/%d, dropped: %d",
+            self.capture.processed,
+            self.capture.captured,
+            self.capture.dropped,
+        )
+        with self.instrument.stage("render"):
+            # 解析スレッドに上書きされないようコピーしてから描画する
+            track = self.live.track.latest().copy()
+            self.db_view.update_view(track["db"], -9, -1)
+            # 無声のフレームは PitchTracker が nn = 0 にしている
+            self.f0_view.update_view(track["nn"], 20, 80)
+
+            for chroma in self.live.chroma.read():
+                self.chords.push(chroma)
+            chord = None if self.chords.current is None else CHORDS[self.chords.current]
+
+            self.score_pitch()
+            note = self.scorer.last_note
+            sec = self.playback.time
+            self.spectrogram_view.update_view(
+                sec,
+                self.live.spectra.read(),
+                chord,
+                self.scorer.score,
+                None if note < 0 else self.scorer.note_score(note),
             )
+        if self.instrument.enabled:
+            self.record_pipeline_state()
+
+    def score_pitch(self):
+        """Score the F0 frames finalized since the last call at the song position where they were sung"""
+        with self.instrument.stage("score"):
+            track = self.live.track
+            overruns = track.overruns
+            new = track.read()
+            self._pitch_frames += track.overruns - overruns
+            for nn in new["nn"]:
+                # フレーム t は t 番目のチャンクとその前のチャンクからなり，中心はチャンク t の先頭
+                position = self.capture.positions.get(self._pitch_frames)
+                self._pitch_frames += 1
+                if position is None or position < 0:
+                    continue  # 一時停止中に歌った (または記録が上書きされた) フレーム
+                self.scorer.push((position - self.CHUNKS) / self.SR, nn)
+
+    def record_pipeline_state(self):
+        """Record the end-to-end latency of the newest chunk on screen and how many chunks are waiting"""
+        capture = self.capture
+        captured_at = capture.last_captured_at
+        if captured_at is not None and captured_at != self._last_captured_at:
+            self.instrument.record("end_to_end", time.perf_counter() - captured_at)
+            self._last_captured_at = captured_at
+        self.instrument.record_backlog(
+            capture.captured - capture.processed - capture.dropped
+        )
+        self.instrument.counters.update(
+            captured=capture.captured,
+            processed=capture.processed,
+            dropped=capture.dropped,
+            overflows=getattr(capture.source, "overflows", 0),
+            underflows=self.playback.underflows,
+        )
 
-        self.tick = len(self.frames)
-
-        sec = self.tick / (self.FR / self.CHUNKS)
-        self.spectrogram_view.update_view(sec)
+    def on_key_down(self, window, key, scancode, codepoint, modifiers):
+        if codepoint == " ":
+            self.playback.toggle_pause()
+            return True
+        if key in (275, 276):  # → / ←
+            step = self.SEEK_SEC if key == 275 else -self.SEEK_SEC
+            self.playback.seek(self.playback.time + step)
+            return True
+        if codepoint == "i":
+            self.toggle_overlay()
+            return True
+        if codepoint == "d":
+            self.dump_instrument(
+                self.instrument_path
+                or f"instrument-{datetime.now():%Y%m%d-%H%M%S}.json"
+            )
+            return True
+        return False
+
+    def toggle_overlay(self):
+        """Show / hide the per-stage latencies on top of the window (measuring only while shown, unless enabled from the command line)"""
+        if self.overlay.parent is None:
+            self.instrument.enabled = True
+            Window.add_widget(self.overlay)
+            self._overlay_event = Clock.schedule_interval(self.update_overlay, 0.25)
+            self.update_overlay()
+        else:
+            self._overlay_event.cancel()
+            Window.remove_widget(self.overlay)
+            self.instrument.enabled = self._always_measure
+
+    def update_overlay(self, *args):
+        self.overlay.text = self.instrument.summary()
+        self.overlay.pos = (10, Window.height - self.overlay.height - 10)
+
+    def dump_instrument(self, path):
+        self.instrument.dump(path)
+        logger.info("wrote pipeline timings to %s", path)
 
 
 class KaraokeApp(App):
+    def __init__(
+        self,
+        source=None,
+        instrument=None,
+        instrument_path=None,
+        silent=False,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.source = source
+        self.instrument = instrument
+        self.instrument_path = instrument_path
+        self.silent = silent
+
     def build(self):
-        self.root = MainWidget()
+        self.root = MainWidget(
+            source=self.source,
+            instrument=self.instrument,
+            instrument_path=self.instrument_path,
+            silent=self.silent,
+        )
         return self.root
 
+    def on_stop(self):
+        self.root.stop()
+
 
 if __name__ == "__main__":
-    if not Path("tmp").exists():
-        Path("tmp").mkdir()
-    KaraokeApp().run()
+    # Kivy 自身のオプションと区別するため，`--` の後に指定する
+    # 例: python app/karaoke_app.py -- --source synth --freq 220
+    parser = argparse.ArgumentParser()
+    add_source_arguments(parser)
+    parser.add_argument(
+        "--instrument",
+        action="store_true",
+        help="measure per-stage latencies from the start (toggle the overlay with the i key)",
+    )
+    parser.add_argument(
+        "--instrument-dump",
+        metavar="PATH",
+        help="write the measured latencies to this JSON file on exit (and on the d key)",
+    )
+    parser.add_argument(
+        "--silent",
+        action="store_true",
+        help="do not play the song, only keep its clock (also used when no output device is available)",
+    )
+    args = parser.parse_args()
+    KaraokeApp(
+        source_from_args(args, MainWidget.SR, MainWidget.CHUNKS, MainWidget.CHANNELS),
+        instrument=Instrumentation(
+            enabled=args.instrument or args.instrument_dump is not None
+        ),
+        instrument_path=args.instrument_dump,
+        silent=args.silent,
+    ).run()
@@ -0,0 +1,238 @@
+"""
+Subharmonic-summation (SHS) pitch estimation on the spectrogram.
+
+    python app/pitch.py data/shs-test-man.wav data/shs-test-woman.wav
+
+compares the SHS F0 track with `frame_f0s` (time-domain autocorrelation) frame by frame against a reference track
+(librosa.pyin, with octave errors corrected) and reports gross errors and wall time for each file.
+"""
+
+import sys
+import time
+
+import librosa
+import numpy as np
+import scipy.sparse
+
+from analyze import (
+    F0_MAX,
+    F0_MIN,
+    AudioAnalyzer,
+    frame_f0s,
+    frame_view,
+    spectrogram_blocks,
+)
+
+# 倍音の数と，n 倍音の重み decay ** (n - 1)
+SHS_HARMONICS = 10
+SHS_DECAY = 0.84
+
+# 候補とする F0 の間隔 [cent]
+SHS_CENTS = 10
+
+# SHS スコアが最大値のこの割合以上の極大を候補とし，波形の周期性で選ぶ
+SHS_PEAK_RATIO = 0.75
+
+# 選んだ候補の前後この範囲で自己相関が最大になる F0 に補正する [cent]
+SHS_REFINE_CENTS = 100
+
+# 基準と比べて誤りとみなす F0 のずれ [cent]
+GROSS_ERROR_CENTS = 50
+
+
+class ShsPitchEstimator:
+    """
+    Scores every candidate F0 (a grid `cents` apart between f0_min and f0_max) by the weighted sum of the
+    spectrum at its first `n_harmonics` harmonics, as one sparse (bins, candidates) matrix product per block.
+    Among the score's peaks within SHS_PEAK_RATIO of the best (an octave apart, or two notes across a note
+    change), the one the frame repeats at most strongly wins: its autocorrelation at the candidate's lag, read
+    off the power spectrum with a dense cosine matrix, which also refines the F0. `check_periodicity=False`
+    keeps the best SHS score alone, for full mixes where the accompaniment has periods of its own.
+    """
+
+    def __init__(
+        self,
+        sr,
+        frame_size,
+        f0_min=F0_MIN,
+        f0_max=F0_MAX,
+        n_harmonics=SHS_HARMONICS,
+        decay=SHS_DECAY,
+        cents=SHS_CENTS,
+        check_periodicity=True,
+    ):
+        self.sr = sr
+        self.frame_size = frame_size
+        self.cents = cents
+        self.check_periodicity = check_periodicity
+        n_bins = frame_size // 2 + 1
+        n_candidates = int(1200 * np.log2(f0_max / f0_min) / cents) + 1
+        self.candidates = f0_min * 2 ** (np.arange(n_candidates) * cents / 1200)
+
+        harmonics = np.arange(1, n_harmonics + 1)
+        bins = np.round(np.outer(self.candidates, harmonics) * frame_size / sr)
+        bins = bins.astype(np.int64)
+        bins[bins >= n_bins] = -1
+        self.harmonic_bins = bins
+
+        valid = bins >= 0
+        weights = np.broadcast_to(decay ** (harmonics - 1), bins.shape)
+        rows = np.broadcast_to(np.arange(n_candidates)[:, None], bins.shape)
+        self.matrix = scipy.sparse.csr_matrix(
+            (weights[valid], (bins[valid], rows[valid])), shape=(n_bins, n_candidates)
+        )
+        self.total_weights = np.asarray(self.matrix.sum(axis=0)).ravel()
+
+        # 自己相関 = パワースペクトルの逆フーリエ変換 (直流とナイキスト以外の bin は負の周波数の分も足す)
+        self.bin_weights = np.full(n_bins, 2.0, dtype=np.float32)
+        self.bin_weights[[0, -1]] = 1
+        lags = sr / self.candidates
+        phase = 2 * np.pi * np.outer(np.arange(n_bins), lags) / frame_size
+        self.lag_matrix = (self.bin_weights[:, None] * np.cos(phase)).astype(np.float32)
+
+    @staticmethod
+    def _power(spectra):
+        return np.exp(2 * np.asarray(spectra, dtype=np.float32))
+
+    def _scores(self, power):
+        # 平方根で圧縮した振幅を各フレームの最大値で正規化する
+        amplitude = np.sqrt(np.sqrt(power))
+        amplitude /= np.maximum(amplitude.max(axis=1, keepdims=True), 1e-10)
+        return self.matrix.T.dot(amplitude.T).T
+
+    def scores(self, spectra):
+        """SHS score of every candidate for each row of a log amplitude spectrogram, shape (n_frames, candidates)"""
+        return self._scores(self._power(spectra))
+
+    def periodicity(self, spectra):
+        """Normalized autocorrelation (-1 to 1) of each row of a log amplitude spectrogram at the lag of every candidate"""
+        return self._periodicity(self._power(spectra))
+
+    def _periodicity(self, power):
+        energy = np.maximum(power.dot(self.bin_weights), 1e-10)
+        return power.dot(self.lag_matrix) / energy[:, None]
+
+    def _pick(self, power):
+        scores = self._scores(power)
+        n = np.arange(len(scores))
+        if not self.check_periodicity:
+            choice = np.argmax(scores, axis=1)
+            confidence = scores[n, choice] / self.total_weights[choice]
+            return self._interpolate(scores, choice), confidence.astype(np.float32)
+
+        periodicity = np.maximum(self._periodicity(power), 0)
+        best = np.maximum(scores.max(axis=1, keepdims=True), 1e-10)
+        is_peak = scores == best
+        is_peak[:, 1:-1] |= (scores[:, 1:-1] > scores[:, :-2]) & (
+            scores[:, 1:-1] >= scores[:, 2:]
+        )
+        is_peak &= scores >= SHS_PEAK_RATIO * best
+        choice = np.argmax(
+            np.where(is_peak, scores / best * periodicity ** 2, -1), axis=1
+        )
+        confidence = scores[n, choice] / self.total_weights[choice]
+        # 前後 SHS_REFINE_CENTS の中で自己相関が最大の候補に移す
+        d = SHS_REFINE_CENTS // self.cents
+        around = np.clip(choice[:, None] + np.arange(-d, d + 1), 0, scores.shape[1] - 1)
+        near = np.take_along_axis(periodicity, around, axis=1)
+        choice = around[n, np.argmax(near, axis=1)]
+        return self._interpolate(periodicity, choice), confidence.astype(np.float32)
+
+    def _interpolate(self, values, choice):
+        # 隣の候補との値に放物線を当てはめて，格子より細かく F0 を求める
+        n = np.arange(len(choice))
+        last = values.shape[1] - 1
+        left = values[n, np.maximum(choice - 1, 0)]
+        center = values[n, choice]
+        right = values[n, np.minimum(choice + 1, last)]
+        denom = left - 2 * center + right
+        offset = np.zeros(len(choice))
+        ok = (choice > 0) & (choice < last) & (denom < 0)
+        offset[ok] = 0.5 * (left[ok] - right[ok]) / denom[ok]
+        f0 = self.candidates[choice] * 2 ** (offset * self.cents / 1200)
+        return f0.astype(np.float32)
+
+    def estimate(self, spectrogram):
+        """F0 [Hz] and confidence (0 to 1) of every frame of a spectrogram, one block of frames at a time"""
+        n_frames = spectrogram.shape[0]
+        f0 = np.empty(n_frames, dtype=np.float32)
+        confidence = np.empty(n_frames, dtype=np.float32)
+        for i, block in spectrogram_blocks(spectrogram):
+            j = i + len(block)
+            f0[i:j], confidence[i:j] = self._pick(self._power(block))
+        return f0, confidence
+
+    def push(self, log_spectrum):
+        """F0 [Hz] and confidence of a single spectrum, e.g. the newest column of the live spectrogram"""
+        f0, confidence = self._pick(self._power(log_spectrum)[None])
+        return float(f0[0]), float(confidence[0])
+
+
+def reference_f0(audio):
+    """
+    Reference F0 track for evaluation: librosa.pyin on the spectrogram's frames, doubled where none of the
+    odd harmonics 1, 3, 5 of its estimate stand out of the spectrum (pyin then picked a subharmonic).
+    NaN where pyin finds the frame unvoiced.
+    """
+    f0, voiced, _ = librosa.pyin(
+        audio.wave,
+        fmin=F0_MIN,
+        fmax=F0_MAX,
+        sr=audio.SR,
+        frame_length=audio.frame_size,
+        hop_length=audio.shift_size,
+        center=False,
+    )
+    spectrogram = np.asarray(audio.spectrogram)
+    f0 = f0[: len(spectrogram)]
+    odd_harmonics = np.array([1, 3, 5])
+    for t in np.flatnonzero(voiced[: len(spectrogram)]):
+        spectrum = spectrogram[t]
+        floor = np.median(spectrum[: len(spectrum) // 2])  # 声の倍音がある 0 - sr/4 の中央値
+        bins = np.round(odd_harmonics * f0[t] * audio.frame_size / audio.SR)
+        peaks = [spectrum[max(b - 2, 0) : b + 3].max() for b in bins.astype(int)]
+        if max(peaks) < floor + 1.0:
+            f0[t] *= 2
+    return f0
+
+
+def gross_error_rate(f0, reference):
+    """Fraction of frames voiced in `reference` where `f0` is off by more than GROSS_ERROR_CENTS"""
+    voiced = np.isfinite(reference)
+    f0 = np.maximum(f0[voiced], 1e-3)  # 0 (推定なし) も誤りとして数える
+    return float(
+        np.mean(np.abs(1200 * np.log2(f0 / reference[voiced])) > GROSS_ERROR_CENTS)
+    )
+
+
+def main(*paths):
+    paths = paths or ("data/shs-test-man.wav", "data/shs-test-woman.wav")
+    for path in paths:
+        audio = AudioAnalyzer(path)
+        estimator = ShsPitchEstimator(audio.SR, audio.frame_size)
+        reference = reference_f0(audio)
+
+        st = time.perf_counter()
+        shs, _ = estimator.estimate(audio.spectrogram)
+        shs_time = time.perf_counter() - st
+
+        # スペクトログラムと同じフレームの自己相関で，まとめて F0 を求める
+        st = time.perf_counter()
+        frames = frame_view(audio.wave, audio.frame_size, audio.shift_size)
+        autocorr = frame_f0s(frames[: len(audio.spectrogram)], audio.SR)
+        autocorr_time = time.perf_counter() - st
+
+        n_voiced = np.isfinite(reference).sum()
+        print(f"{path}: {n_voiced} voiced frames")
+        for name, f0, elapsed in (
+            ("SHS", shs, shs_time),
+            ("frame_f0s", autocorr, autocorr_time),
+        ):
+            rate = gross_error_rate(f0, reference)
+            print(
+                f"  {name:>9}: gross errors {rate * 100:5.1f}%, {elapsed * 1000:7.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__file__)
+
+
+class PlaybackEngine:
+    """
+    Plays an in-memory mono waveform through PyAudio in callback mode, `block` samples per callback, so the
+    song is decoded once (e.g. the AudioAnalyzer's wave) and never read from the file again.
+
+    `position` is the index of the sample being heard: the start of the block last handed to PortAudio minus
+    the stream's output latency, advanced by the time elapsed since that callback. Only the callback thread
+    moves the clock; `seek`, `pause` and `resume` leave requests that it applies at the next block, so other
+    threads (the UI, the capture callback) can read the clock at any time without locks. At the end of the
+    song the stream keeps running and plays silence (`finished` is set), so seeking back still works.
+    PyAudio is imported only in `start`.
+    """
+
+    def __init__(self, wave, sr=16000, block=1024):
+        self.wave = np.ascontiguousarray(wave, dtype=np.float32)
+        self.sr = sr
+        self.block = block
+        self.paused = False
+        self.finished = threading.Event()
+        self.underflows = 0  # PortAudio 側で出力が途切れた回数
+        self.pyaudio = None
+        self.stream = None
+        self._silence = np.zeros(block, dtype=np.float32)
+        self._next = 0  # 次のブロックの先頭 (コールバックのスレッドだけが更新する)
+        self._seek = None  # 次のブロックから再生する位置
+        self._latency = 0  # 出力の遅延 [サンプル]
+        # (時刻 at に聞こえているサンプル, at); 止まっている間は at = None
+        # まとめて置き換えるので，他のスレッドからも食い違いなく読める
+        self._clock = (0, None)
+
+    @property
+    def duration(self):
+        return len(self.wave) / self.sr
+
+    @property
+    def position(self):
+        """Index of the sample being played now"""
+        seek = self._seek
+        if seek is not None:
+            return seek
+        base, at = self._clock
+        if at is not None:
+            base += min(int((time.perf_counter() - at) * self.sr), self.block)
+        return min(max(base, 0), len(self.wave))
+
+    @property
+    def time(self):
+        """Playback position [sec]"""
+        return self.position / self.sr
+
+    def start(self):
+        import pyaudio
+
+        def callback(in_data, frame_count, time_info, status_flags):
+            if status_flags & pyaudio.paOutputUnderflow:
+                self.underflows += 1
+            return self._next_block(frame_count).tobytes(), pyaudio.paContinue
+
+        self.finished.clear()
+        self.pyaudio = pyaudio.PyAudio()
+        self.stream = self.pyaudio.open(
+            format=pyaudio.paFloat32,
+            channels=1,
+            rate=self.sr,
+            output=True,
+            frames_per_buffer=self.block,
+            stream_callback=callback,
+        )
+        self._latency = int(self.stream.get_output_latency() * self.sr)
+        self.stream.start_stream()
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        if self.pyaudio is not None:
+            self.pyaudio.terminate()
+            self.pyaudio = None
+        self.finished.set()
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def toggle_pause(self):
+        self.paused = not self.paused
+
+    def seek(self, sec):
+        """Continue playing from `sec` seconds (clamped to the song)"""
+        self._seek = min(max(int(sec * self.sr), 0), len(self.wave))
+
+    def _next_block(self, frame_count):
+        """The next `frame_count` samples to play; moves the clock (called from the playback thread only)"""
+        seek = self._seek
+        if seek is not None:
+            self._next = seek
+            if seek < len(self.wave):
+                self.finished.clear()
+        start = self._next
+        if self.paused or start >= len(self.wave):
+            self._clock = (start - self._latency, None)
+            self._clear_seek(seek)
+            return self._silence[:frame_count]
+        block = self.wave[start : start + frame_count]
+        self._next = start + len(block)
+        self._clock = (start - self._latency, time.perf_counter())
+        self._clear_seek(seek)  # 時計を更新してから外す
+        if len(block) < frame_count:
+            # 曲の終わり: 残りを無音で埋め，次からは無音を流し続ける
+            self.finished.set()
+            block = np.concatenate([block, self._silence[: frame_count - len(block)]])
+        return block
+
+    def _clear_seek(self, seek):
+        # 再生中に新しく seek されていたら次のブロックで反映する
+        if self._seek is seek:
+            self._seek = None
+
+
+class SilentPlayback(PlaybackEngine):
+    """
+    A PlaybackEngine without an output device: a thread takes a block every `block / sr` seconds and discards
+    it, so the clock, seek and pause behave the same (e.g. for running the karaoke app headless).
+    """
+
+    def __init__(self, wave, sr=16000, block=1024):
+        super().__init__(wave, sr, block)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.finished.clear()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.finished.set()
+
+    def _run(self):
+        st = time.perf_counter()
+        i = 0
+        while not self._stop.is_set():
+            self._next_block(self.block)
+            i += 1
+            delay = st + i * self.block / self.sr - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+
+
+def start_playback(wave, sr=16000, block=1024, silent=False):
+    """Start playing `wave`, on a SilentPlayback if `silent` or if PyAudio or an output device is missing"""
+    if not silent:
+        playback = PlaybackEngine(wave, sr, block)
+        try:
+            playback.start()
+            return playback
+        except (ImportError, OSError) as e:
+            playback.stop()
+            logger.warning("playing the song silently: %s", e)
+    playback = SilentPlayback(wave, sr, block)
+    playback.start()
+    return playback
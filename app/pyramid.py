@@ -0,0 +1,152 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class WaveformPyramid:
+    """
+    Multi-resolution min/max envelope of a waveform for drawing it at any zoom level.
+
+    Level k summarizes blocks of `base * 2 ** k` samples by their minimum and maximum, so a range of the
+    waveform can be drawn with at most about 2 points per pixel regardless of its length.
+    """
+
+    def __init__(self, wave, base=16):
+        self.wave = np.asarray(wave, dtype=np.float32)
+        self.base = base
+        self.levels = []  # (ブロックサイズ, 最小値, 最大値)
+
+        # 端数は最後の値で埋めて 1 ブロックにする
+        padded = self.wave
+        if len(padded) % base:
+            padded = np.pad(padded, (0, -len(padded) % base), mode="edge")
+        mins = padded.reshape(-1, base).min(axis=1)
+        maxs = padded.reshape(-1, base).max(axis=1)
+        size = base
+        while len(mins) > 0:
+            self.levels.append((size, mins, maxs))
+            if len(mins) == 1:
+                break
+            if len(mins) % 2:
+                mins = np.append(mins, mins[-1])
+                maxs = np.append(maxs, maxs[-1])
+            mins = np.minimum(mins[0::2], mins[1::2])
+            maxs = np.maximum(maxs[0::2], maxs[1::2])
+            size *= 2
+
+        # 全体の最小値・最大値は一度だけ計算しておく
+        self.min = float(self.wave.min()) if len(self.wave) else 0.0
+        self.max = float(self.wave.max()) if len(self.wave) else 0.0
+
+    def envelope(self, s, t, width):
+        """
+        Return (x, y) to plot samples [s, t) on `width` pixels.
+        Short ranges are returned as raw samples, longer ones as alternating min / max of the coarsest level that still has a block per pixel.
+        """
+        s = max(int(s), 0)
+        t = min(int(t), len(self.wave))
+        width = max(int(width), 1)
+        if t - s <= 2 * width or not self.levels:
+            return np.arange(s, t), self.wave[s:t]
+
+        for size, mins, maxs in self.levels:
+            if (t - s) / size <= width:
+                break
+        first = s // size
+        last = min(-(-t // size), len(mins))
+        lo = mins[first:last]
+        hi = maxs[first:last]
+        x = np.repeat((np.arange(first, last) + 0.5) * size, 2)
+        y = np.empty(2 * len(lo), dtype=np.float32)
+        y[0::2] = lo
+        y[1::2] = hi
+        return x, y
+
+
+def max_pool(a, factor, axis):
+    """Downsample `a` by `factor` along `axis` by taking the maximum of each group (the last group may be shorter)"""
+    a = np.asarray(a)
+    if factor == 1:
+        return a
+    n = a.shape[axis]
+    pad = -n % factor
+    if pad:
+        pad_width = [(0, 0)] * a.ndim
+        pad_width[axis] = (0, pad)
+        a = np.pad(a, pad_width, mode="edge")
+    shape = a.shape[:axis] + (-1, factor) + a.shape[axis + 1 :]
+    return a.reshape(shape).max(axis=axis + 1)
+
+
+class SpectrogramPyramid:
+    """
+    Tile pyramid (mipmap) of a (frames, bins) spectrogram for zoomable views.
+
+    Level (i, j) is the spectrogram max-pooled by 2 ** i in time and 2 ** j in frequency. A level is built on
+    first use straight from the spectrogram, a block of frames at a time pooled along both axes (so a
+    LazySpectrogram works as the source and only one block of full-resolution frames is in memory). Only the
+    `max_levels` most recently used levels are kept; with a FeatureCache they are also stored on disk and kept
+    memory-mapped.
+    """
+
+    def __init__(self, spectrogram, cache=None, key=None, max_levels=4):
+        self.spectrogram = spectrogram
+        self.shape = spectrogram.shape
+        self.cache = cache
+        self.key = key
+        self.max_levels = max_levels
+        self._levels = OrderedDict()  # (i, j) -> 配列 (最近使ったものが末尾)
+
+    def level(self, i, j):
+        if (i, j) == (0, 0):
+            return self.spectrogram
+        if (i, j) in self._levels:
+            self._levels.move_to_end((i, j))
+            return self._levels[i, j]
+        if self.cache is None:
+            array = self._build(i, j)
+        else:
+            # 保存したものを memmap で開き直して持つ
+            array = self.cache.get_or_compute(
+                self.key, f"pyramid_{i}_{j}", lambda: self._build(i, j)
+            )
+        self._levels[i, j] = array
+        if len(self._levels) > self.max_levels:
+            self._levels.popitem(last=False)
+        return array
+
+    def _build(self, i, j):
+        from analyze import SPECTROGRAM_BLOCK_FRAMES, spectrogram_blocks
+
+        fi, fj = 2 ** i, 2 ** j
+        n_frames, n_bins = self.shape
+        out = np.empty((-(-n_frames // fi), -(-n_bins // fj)), dtype=np.float32)
+        # 時間方向に間引くのでブロックの大きさを fi の倍数にする
+        step = -(-SPECTROGRAM_BLOCK_FRAMES // fi) * fi
+        for k, block in spectrogram_blocks(self.spectrogram, step):
+            block = max_pool(max_pool(block, fi, 0), fj, 1)
+            out[k // fi : k // fi + len(block)] = block
+        return out
+
+    def view(self, s, t, width, height, bin_lo=0, bin_hi=None):
+        """
+        Pick the coarsest level that still has at least one frame per pixel of `width` and one bin per pixel of
+        `height` for frames [s, t) and bins [bin_lo, bin_hi).
+        Return (image, (frame_lo, frame_hi), (bin_lo, bin_hi)) where image is the crop of that level and the
+        ranges are the frames / bins of the original spectrogram it actually covers.
+        """
+        n_frames, n_bins = self.shape
+        bin_hi = n_bins if bin_hi is None else bin_hi
+        s = int(np.clip(s, 0, n_frames))
+        t = int(np.clip(t, s, n_frames))
+        i = int(np.log2(max((t - s) / max(width, 1), 1)))
+        j = int(np.log2(max((bin_hi - bin_lo) / max(height, 1), 1)))
+        level = self.level(i, j)
+        fs, ft = s >> i, -(-t // 2 ** i)
+        bs, bt = bin_lo >> j, -(-bin_hi // 2 ** j)
+        image = np.asarray(level[fs:ft, bs:bt])
+        return (
+            image,
+            (fs * 2 ** i, min(ft * 2 ** i, n_frames)),
+            (bs * 2 ** j, min(bt * 2 ** j, n_bins)),
+        )
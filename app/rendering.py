@@ -0,0 +1,155 @@
+import time
+
+import numpy as np
+from kivy.clock import Clock
+
+from instrument import Instrumentation
+from ringbuffer import RingBuffer
+
+
+class FigureRenderer:
+    """
+    Redraws a Matplotlib figure shown with FigureCanvasKivyAgg using blitting.
+
+    The figure without its animated artists (lines, cursors, ...) is rendered once and kept as a background;
+    an update only restores that background, draws the animated artists and uploads the changed axes region to
+    the Kivy texture. A full render happens only when an axis limit changes or the widget is resized.
+    Any number of `request()` calls within one Kivy frame are coalesced into a single draw.
+    """
+
+    def __init__(self, fig, widget, animated=(), instrument=None):
+        self.fig = fig
+        self.widget = widget  # FigureCanvasKivyAgg
+        self.instrument = Instrumentation() if instrument is None else instrument
+        self.animated = []
+        for artist in animated:
+            self.add_animated(artist)
+
+        self._background = None
+        self._limits = None
+        self._full = False
+        self._trigger = Clock.create_trigger(self._render)
+        fig.canvas.mpl_connect("draw_event", self._on_draw)
+
+        self.requests = 0  # update_fig が呼ばれた回数
+        self.renders = 0  # 実際に描画した回数
+        self.full_renders = 0
+        self.frame_times = RingBuffer(120, dtype=np.float64)  # 1 回の描画にかかった時間 [sec]
+
+    def add_animated(self, artist):
+        artist.set_animated(True)
+        self.animated.append(artist)
+
+    def request(self, full=False):
+        """Schedule a redraw at the next Kivy frame (`full=True` when non-animated artists changed too)"""
+        self.requests += 1
+        self._full = self._full or full
+        self._trigger()
+
+    def stats(self):
+        """Frame time statistics [msec] and how many requests were merged into a single draw"""
+        times = self.frame_times.latest() * 1000
+        return {
+            "renders": self.renders,
+            "full_renders": self.full_renders,
+            "coalesced": self.requests - self.renders,
+            "mean_ms": float(times.mean()) if len(times) else 0.0,
+            "p95_ms": float(np.percentile(times, 95)) if len(times) else 0.0,
+        }
+
+    def _current_limits(self):
+        return tuple((ax.get_xlim(), ax.get_ylim()) for ax in self.fig.axes)
+
+    def _on_draw(self, event):
+        # 通常の描画 (リサイズ時など) の後で背景を取り直し，アニメーションする部分を重ねる
+        self._background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._limits = self._current_limits()
+        for artist in self.animated:
+            artist.axes.draw_artist(artist)
+
+    def _render(self, *args):
+        st = time.perf_counter()
+        texture = getattr(self.widget, "img_texture", None)
+        if (
+            self._full
+            or self._background is None
+            or texture is None
+            or self._limits != self._current_limits()
+        ):
+            self._full = False
+            self.widget.draw()
+            self.full_renders += 1
+        else:
+            self.fig.canvas.restore_region(self._background)
+            for artist in self.animated:
+                artist.axes.draw_artist(artist)
+            self._upload(texture)
+        self.renders += 1
+        self.frame_times.write(time.perf_counter() - st)
+        self.instrument.record("plot", time.perf_counter() - st)
+
+    def _upload(self, texture):
+        """Copy the axes regions of the Agg buffer into the Kivy texture"""
+        buf = np.asarray(self.fig.canvas.get_renderer().buffer_rgba())
+        height, width = buf.shape[:2]
+        for ax in {artist.axes for artist in self.animated}:
+            # Matplotlib の座標は左下原点，バッファの行は上から
+            bbox = ax.bbox.expanded(1.02, 1.02)
+            x0 = max(int(np.floor(bbox.x0)), 0)
+            x1 = min(int(np.ceil(bbox.x1)), width)
+            r0 = max(height - int(np.ceil(bbox.y1)), 0)
+            r1 = min(height - int(np.floor(bbox.y0)), height)
+            if x1 <= x0 or r1 <= r0:
+                continue
+            texture.blit_buffer(
+                np.ascontiguousarray(buf[r0:r1, x0:x1]).tobytes(),
+                size=(x1 - x0, r1 - r0),
+                pos=(x0, r0),
+                colorfmt="rgba",
+                bufferfmt="ubyte",
+            )
+        self.widget.canvas.ask_update()
+
+
+class UpdateScheduler:
+    """
+    Coalesces view updates triggered by UI events (e.g. dragging a slider).
+
+    `schedule(update, *args)` only records the latest arguments for `update`; once per Kivy frame every pending
+    update is called with its latest arguments, and skipped if they are the same as the last time it ran.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._last = {}
+        self._trigger = Clock.create_trigger(self._flush)
+
+        self.requests = 0  # schedule が呼ばれた回数
+        self.merged = 0  # 同じフレーム内の新しい値で置き換えられた回数
+        self.skipped = 0  # 値が変わっていないので呼ばなかった回数
+        self.updates = 0  # 実際に呼んだ回数
+
+    def schedule(self, update, *args):
+        self.requests += 1
+        if update in self._pending:
+            self.merged += 1
+        self._pending[update] = args
+        self._trigger()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "merged": self.merged,
+            "skipped": self.skipped,
+            "updates": self.updates,
+        }
+
+    def _flush(self, *args):
+        pending, self._pending = self._pending, {}
+        for update, args in pending.items():
+            if self._last.get(update) == args:
+                self.skipped += 1
+                continue
+            self._last[update] = args
+            update(*args)
+            self.updates += 1
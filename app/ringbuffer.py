@@ -0,0 +1,87 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed-capacity, preallocated ring buffer of NumPy items.
+
+    Safe without locks for one producer thread calling `write` and one consumer thread calling `read`.
+    The storage is mirrored (every item is stored twice, `capacity` apart) so that the last N items and
+    any unread range are always contiguous and can be returned as views instead of copies.
+    Views are only valid until the producer writes over them, so copy them if they are kept around.
+    """
+
+    def __init__(self, capacity, dtype=np.float32, shape=(), fill=0):
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self._data = np.full((2 * capacity,) + self.shape, fill, dtype=self.dtype)
+        self._written = 0  # producer だけが更新する
+        self._read = 0  # consumer だけが更新する
+        self.overruns = 0  # 読まれる前に上書きされたアイテム数
+
+    def __len__(self):
+        return min(self._written, self.capacity)
+
+    @property
+    def total_written(self):
+        """Number of items written since creation"""
+        return self._written
+
+    @property
+    def available(self):
+        """Number of items that `read` would return"""
+        return min(self._written - self._read, self.capacity)
+
+    def write(self, items):
+        """Append `items` (an array of items, or a single item); only the last `capacity` of them are kept"""
+        items = np.asarray(items, dtype=self.dtype)
+        if items.shape == self.shape:
+            items = items[None]
+        n = len(items)
+        items = items[-self.capacity :]
+        cap = self.capacity
+        pos = (self._written + n - len(items)) % cap
+        first = min(len(items), cap - pos)
+        rest = len(items) - first
+        self._data[pos : pos + first] = items[:first]
+        self._data[cap + pos : cap + pos + first] = items[:first]
+        if rest > 0:
+            self._data[:rest] = items[first:]
+            self._data[cap : cap + rest] = items[first:]
+        # データを書き終えてから公開する
+        self._written += n
+
+    def latest(self, n=None):
+        """Read-only view of the last `n` items (all stored items if `n` is None), oldest first"""
+        written = self._written
+        n = min(written, self.capacity) if n is None else min(n, written, self.capacity)
+        end = written % self.capacity + self.capacity
+        view = self._data[end - n : end]
+        view.flags.writeable = False
+        return view
+
+    def get(self, index):
+        """Item number `index` counting from the first item ever written, or None if it is not stored (yet or any more)"""
+        if not self._written - self.capacity <= index < self._written:
+            return None
+        return self._data[index % self.capacity]
+
+    def read(self, max_items=None):
+        """
+        Consume and return a read-only view of the items written since the last `read` (at most `max_items`).
+        Items that were overwritten before being read are skipped and counted in `overruns`.
+        """
+        written = self._written
+        start = self._read
+        if written - start > self.capacity:
+            self.overruns += written - start - self.capacity
+            start = written - self.capacity
+        n = written - start
+        if max_items is not None:
+            n = min(n, max_items)
+        pos = start % self.capacity
+        view = self._data[pos : pos + n]
+        view.flags.writeable = False
+        self._read = start + n
+        return view
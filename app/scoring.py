@@ -0,0 +1,252 @@
+"""
+Karaoke scoring: the song's reference pitch track is estimated once (and stored in the FeatureCache with its
+other features), and the singer's F0 stream is compared with it in realtime at the playback position.
+
+    python app/scoring.py data/not-anyone-else-mono.mp3 data/aiueo.wav
+
+streams the second file (the "singer", the song itself by default) through a PitchTracker chunk by chunk as the
+karaoke app does, scores it against the first, and reports the running and per-note scores and time per hop.
+"""
+
+import sys
+import time
+
+import numpy as np
+import scipy.signal
+
+from analyze import AudioAnalyzer, PitchTracker
+from cache import FeatureCache
+from pitch import ShsPitchEstimator
+
+# 伴奏のベースを拾わないよう，参照の F0 は歌声の範囲で探す [Hz]
+REFERENCE_F0_MIN = 130.0
+REFERENCE_F0_MAX = 1000.0
+
+# SHS の確信度がこれ未満のフレームは無声とみなす
+REFERENCE_MIN_CONFIDENCE = 0.4
+
+# 参照の F0 にかけるメディアンフィルタの幅 [フレーム]
+REFERENCE_SMOOTHING = 9
+
+# これより短い音は採点しない [sec]
+MIN_NOTE_SEC = 0.1
+
+# 参照とのずれがこれ以内なら正解 [cent]
+TOLERANCE_CENTS = 100
+
+# 歌い出しの早い・遅いを許す範囲 [sec]
+SEARCH_SEC = 0.2
+
+# 採点する音符 (開始・終了 [参照のフレーム番号]，ノートナンバー)
+NOTE_DTYPE = np.dtype([("start", np.int64), ("end", np.int64), ("nn", np.float32)])
+
+
+def estimate_reference(
+    spectrogram,
+    sr,
+    frame_size,
+    f0_min=REFERENCE_F0_MIN,
+    f0_max=REFERENCE_F0_MAX,
+    min_confidence=REFERENCE_MIN_CONFIDENCE,
+    smoothing=REFERENCE_SMOOTHING,
+):
+    """
+    Note number (fractional) of the predominant pitch of every spectrogram frame, 0 where unvoiced.
+    On a full mix this follows the loudest melody in the vocal range, which is usually the singer.
+    """
+    # 伴奏も波形の周期性に混ざるので，SHS のスコアだけで選ぶ
+    estimator = ShsPitchEstimator(
+        sr, frame_size, f0_min, f0_max, check_periodicity=False
+    )
+    f0, confidence = estimator.estimate(spectrogram)
+    nn = 12.0 * np.log2(f0 / 440.0) + 69
+    nn = scipy.signal.medfilt(nn, smoothing).astype(np.float32)
+    nn[confidence < min_confidence] = 0
+    return nn
+
+
+def reference_pitch(
+    audio,
+    f0_min=REFERENCE_F0_MIN,
+    f0_max=REFERENCE_F0_MAX,
+    min_confidence=REFERENCE_MIN_CONFIDENCE,
+    smoothing=REFERENCE_SMOOTHING,
+):
+    """Reference note numbers of an AudioAnalyzer's frames (see `estimate_reference`), cached with its features"""
+    # パラメータを変えたら別の名前で保存されるようにする
+    name = f"reference_pitch_{f0_min:g}_{f0_max:g}_{min_confidence:g}_{smoothing}"
+    return audio.cached(
+        name,
+        lambda: estimate_reference(
+            audio.spectrogram,
+            audio.SR,
+            audio.frame_size,
+            f0_min,
+            f0_max,
+            min_confidence,
+            smoothing,
+        ),
+    )
+
+
+def reference_notes(nn, min_frames):
+    """
+    Split a reference track into notes: runs of voiced frames on the same (rounded) note number lasting at least
+    `min_frames`. Returns the notes (NOTE_DTYPE, nn is the median of the run) and the note index of every
+    frame (-1 outside notes).
+    """
+    nn = np.asarray(nn, dtype=np.float32)
+    note = np.where(nn > 0, np.round(nn), 0)
+    edges = np.flatnonzero(np.diff(note)) + 1
+    starts = np.concatenate([[0], edges])
+    ends = np.concatenate([edges, [len(note)]])
+    keep = (note[starts] > 0) & (ends - starts >= min_frames)
+    notes = np.zeros(keep.sum(), dtype=NOTE_DTYPE)
+    notes["start"] = starts[keep]
+    notes["end"] = ends[keep]
+    notes["nn"] = [np.median(nn[s:e]) for s, e in zip(starts[keep], ends[keep])]
+    note_of_frame = np.full(len(nn), -1, dtype=np.int64)
+    for i, (s, e) in enumerate(zip(notes["start"], notes["end"])):
+        note_of_frame[s:e] = i
+    return notes, note_of_frame
+
+
+class PitchScorer:
+    """
+    Scores the singer's F0 against a reference track (note number per frame, every `hop_sec` seconds, the
+    first centered at `offset_sec`), one live frame at a time.
+
+    `push(sec, nn)` takes the singer's note number at song position `sec`. If a reference note is playing
+    there, the frame counts towards it, and is a hit when some voiced reference frame within `search_sec`
+    of it is within `tolerance_cents` (ignoring octaves unless `octave_invariant` is False, so a singer can
+    sing an octave lower). Unvoiced live frames inside a note are misses. All comparisons are done on
+    arrays allocated up front, so a push costs a few microseconds regardless of the length of the song.
+    """
+
+    def __init__(
+        self,
+        reference,
+        hop_sec,
+        offset_sec=0.0,
+        tolerance_cents=TOLERANCE_CENTS,
+        search_sec=SEARCH_SEC,
+        min_note_sec=MIN_NOTE_SEC,
+        octave_invariant=True,
+    ):
+        self.reference = np.array(reference, dtype=np.float32)
+        self.hop_sec = hop_sec
+        self.offset_sec = offset_sec
+        self.tolerance = tolerance_cents / 100  # 半音単位
+        self.octave_invariant = octave_invariant
+        self.search = int(round(search_sec / hop_sec))
+        self.notes, self.note_of_frame = reference_notes(
+            self.reference, max(int(round(min_note_sec / hop_sec)), 1)
+        )
+        self._unvoiced = self.reference <= 0
+        self._diff = np.empty(2 * self.search + 1, dtype=np.float32)
+        self.hits = np.zeros(len(self.notes), dtype=np.int64)
+        self.frames = np.zeros(len(self.notes), dtype=np.int64)
+        self.reset()
+
+    @classmethod
+    def from_audio(cls, audio, **kwargs):
+        """Scorer for the song analyzed by an AudioAnalyzer, using its (cached) reference pitch"""
+        return cls(
+            reference_pitch(audio),
+            audio.shift_size / audio.SR,
+            audio.frame_size / 2 / audio.SR,  # フレームの中心の時刻
+            **kwargs,
+        )
+
+    def reset(self):
+        self.hits[:] = 0
+        self.frames[:] = 0
+        self.total_hits = 0
+        self.total_frames = 0
+        self.last_note = -1  # 最後に採点した音符
+        self.last_error = None  # 最後に採点したフレームのずれ [cent]
+
+    def push(self, sec, nn):
+        """Score the singer's note number `nn` (0 if unvoiced) at song position `sec`; True for a hit, False for a miss, None outside notes"""
+        i = int(round((sec - self.offset_sec) / self.hop_sec))
+        if not 0 <= i < len(self.reference):
+            return None
+        note = self.note_of_frame[i]
+        if note < 0:
+            return None
+        self.frames[note] += 1
+        self.total_frames += 1
+        self.last_note = note
+        self.last_error = None
+        if nn <= 0:
+            return False
+        lo = max(i - self.search, 0)
+        hi = min(i + self.search + 1, len(self.reference))
+        diff = self._diff[: hi - lo]
+        np.subtract(self.reference[lo:hi], nn, out=diff)
+        if self.octave_invariant:
+            # -6 ~ +6 半音に折り返す
+            diff += 6
+            np.mod(diff, 12, out=diff)
+            diff -= 6
+        np.abs(diff, out=diff)
+        np.copyto(diff, np.inf, where=self._unvoiced[lo:hi])
+        error = diff.min()
+        self.last_error = float(error) * 100
+        if error > self.tolerance:
+            return False
+        self.hits[note] += 1
+        self.total_hits += 1
+        return True
+
+    @property
+    def score(self):
+        """Running score (0 - 100): percentage of the frames scored so far that were hits"""
+        return 100.0 * self.total_hits / max(self.total_frames, 1)
+
+    def note_scores(self):
+        """Score (0 - 100) of every note, NaN for notes not reached yet"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.frames > 0, 100.0 * self.hits / self.frames, np.nan)
+
+    def note_score(self, note):
+        return 100.0 * self.hits[note] / max(self.frames[note], 1)
+
+
+def main(song_path="data/not-anyone-else-mono.mp3", singer_path=None):
+    song = AudioAnalyzer(song_path, cache=FeatureCache())
+    st = time.perf_counter()
+    scorer = PitchScorer.from_audio(song)
+    print(
+        f"reference: {len(scorer.notes)} notes in {len(scorer.reference)} frames,"
+        f" ready in {(time.perf_counter() - st) * 1000:.1f} ms"
+    )
+
+    # カラオケアプリと同じく，1 チャンクごとに F0 を求めて採点する
+    singer = song if singer_path is None else AudioAnalyzer(singer_path)
+    chunk = 1024
+    tracker = PitchTracker(singer.SR, hop=chunk, frame_size=2 * chunk)
+    times = []
+    n_frames = 0
+    for i in range(0, len(singer.wave) - chunk + 1, chunk):
+        for record in tracker.push(singer.wave[i : i + chunk]):
+            st = time.perf_counter()
+            # フレーム t は t * chunk サンプル目を中心とする
+            scorer.push(n_frames * chunk / singer.SR, record["nn"])
+            times.append(time.perf_counter() - st)
+            n_frames += 1
+
+    scores = scorer.note_scores()
+    reached = np.isfinite(scores)
+    print(
+        f"score: {scorer.score:.1f} over {scorer.total_frames} frames,"
+        f" {reached.sum()} notes (mean {np.mean(scores[reached]):.1f},"
+        f" {np.mean(scores[reached] >= 50) * 100:.0f}% of them >= 50)"
+    )
+    print(
+        f"push: mean {np.mean(times) * 1e6:.1f} us, max {np.max(times) * 1e6:.1f} us per hop"
+    )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
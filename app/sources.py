@@ -0,0 +1,185 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import librosa
+import numpy as np
+
+from analyze import generate_sinusoid
+from audio_io import decode_pcm16
+
+
+class AudioSource(ABC):
+    """
+    Base class for everything that can feed audio into the realtime pipeline.
+
+    `start(callback)` begins calling `callback(data)` from a background thread with chunks of `chunk` samples
+    at `sr` Hz, until `stop()` is called or the source runs out (`finished` is set). `data` is whatever the
+    source receives (e.g. raw PyAudio bytes), so the callback stays cheap; `decode(data)` turns it into mono
+    float32 samples on the consumer's thread.
+    """
+
+    def __init__(self, sr, chunk):
+        self.sr = sr
+        self.chunk = chunk
+        self.finished = threading.Event()
+
+    @abstractmethod
+    def start(self, callback):
+        pass
+
+    def decode(self, data):
+        return data
+
+    def stop(self):
+        pass
+
+
+class PyAudioSource(AudioSource):
+    """
+    Microphone input through PyAudio in callback mode.
+    PyAudio is imported only here, so the file and synthetic sources work on machines without it.
+    """
+
+    def __init__(self, sr=16000, chunk=1024, channels=2, format=None):
+        import pyaudio
+
+        super().__init__(sr, chunk)
+        self.channels = channels
+        self.format = pyaudio.paInt16 if format is None else format
+        self.overflows = 0  # PortAudio 側で入力があふれた回数
+        self.pyaudio = None
+        self.stream = None
+
+    def start(self, callback):
+        import pyaudio
+
+        def stream_callback(in_data, frame_count, time_info, status_flags):
+            if status_flags & pyaudio.paInputOverflow:
+                self.overflows += 1
+            callback(in_data)  # デコードは CaptureEngine の解析スレッドで行う
+            return None, pyaudio.paContinue
+
+        self.pyaudio = pyaudio.PyAudio()
+        self.stream = self.pyaudio.open(
+            format=self.format,
+            channels=self.channels,
+            rate=self.sr,
+            input=True,
+            frames_per_buffer=self.chunk,
+            stream_callback=stream_callback,
+        )
+        self.stream.start_stream()
+
+    def decode(self, data):
+        return decode_pcm16(data, self.channels)
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        if self.pyaudio is not None:
+            self.pyaudio.terminate()
+            self.pyaudio = None
+        self.finished.set()
+
+
+class ArraySource(AudioSource):
+    """
+    Replays an in-memory waveform chunk by chunk.
+    With `realtime=True` chunks are paced like a microphone would deliver them, otherwise as fast as the callback returns.
+    """
+
+    def __init__(self, wave, sr=16000, chunk=1024, realtime=True, loop=False):
+        super().__init__(sr, chunk)
+        self.wave = np.asarray(wave, dtype=np.float32)
+        self.realtime = realtime
+        self.loop = loop
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, callback):
+        self._stop.clear()
+        self.finished.clear()
+        self._thread = threading.Thread(target=self._run, args=(callback,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, callback):
+        n_chunks = len(self.wave) // self.chunk
+        st = time.perf_counter()
+        i = 0
+        while not self._stop.is_set() and (self.loop or i < n_chunks) and n_chunks > 0:
+            if self.realtime:
+                delay = st + (i + 1) * self.chunk / self.sr - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            k = i % n_chunks
+            callback(self.wave[k * self.chunk : (k + 1) * self.chunk])
+            i += 1
+        self.finished.set()
+
+
+class FileSource(ArraySource):
+    """Replays a WAV/MP3 file"""
+
+    def __init__(self, audio_path, sr=16000, chunk=1024, realtime=True, loop=False):
+        wave, _ = librosa.load(audio_path, sr=sr)
+        super().__init__(wave, sr, chunk, realtime, loop)
+
+
+class SyntheticSource(ArraySource):
+    """Replays a sum of sinusoids made with `generate_sinusoid`"""
+
+    def __init__(
+        self,
+        frequencies=(440.0,),
+        duration=10.0,
+        amplitude=0.3,
+        sr=16000,
+        chunk=1024,
+        realtime=True,
+        loop=False,
+    ):
+        wave = sum(generate_sinusoid(sr, f, duration) for f in frequencies)
+        super().__init__(amplitude * wave / len(frequencies), sr, chunk, realtime, loop)
+
+
+def add_source_arguments(parser):
+    """Add the command line options selecting an AudioSource to an argparse parser"""
+    parser.add_argument(
+        "--source",
+        choices=["mic", "file", "synth"],
+        default="mic",
+        help="where the live input comes from",
+    )
+    parser.add_argument(
+        "--input", default="data/aiueo.wav", help="audio file for --source file"
+    )
+    parser.add_argument(
+        "--freq",
+        type=float,
+        nargs="+",
+        default=[440.0],
+        help="sinusoid frequencies [Hz] for --source synth",
+    )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="replay file/synth input as fast as possible instead of in real time",
+    )
+
+
+def source_from_args(args, sr, chunk, channels=2):
+    """Create the AudioSource selected by the options of `add_source_arguments`"""
+    if args.source == "file":
+        return FileSource(args.input, sr, chunk, realtime=not args.fast)
+    if args.source == "synth":
+        return SyntheticSource(args.freq, sr=sr, chunk=chunk, realtime=not args.fast)
+    return PyAudioSource(sr, chunk, channels)
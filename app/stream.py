@@ -0,0 +1,215 @@
+import math
+from collections import namedtuple
+from math import gcd
+
+import audioread
+import numpy as np
+import scipy.signal
+import soundfile
+
+from analyze import (
+    FRAME_FEATURE_DTYPE,
+    AudioAnalyzer,
+    frame_f0s,
+    frame_features,
+    frame_view,
+    log_rms,
+    log_spectra,
+)
+from audio_io import decode_pcm16
+
+# ストリーミング読み込みで 1 度に扱うサンプル数のデフォルト値
+STREAM_BLOCK_SIZE = 1 << 16
+
+# stream_features が 1 ブロックごとに返す特徴量
+FeatureBlock = namedtuple("FeatureBlock", ["start", "spectrogram", "volume", "f0"])
+
+
+class StreamingResampler:
+    """
+    Polyphase resampler that can be fed a signal block by block.
+
+    Uses the same anti-aliasing filter as `scipy.signal.resample_poly`, and the concatenation of all outputs
+    (including `flush()`) equals `resample_poly` applied to the whole signal.
+    """
+
+    def __init__(self, sr_in, sr_out):
+        g = gcd(int(sr_in), int(sr_out))
+        self.up = int(sr_out) // g
+        self.down = int(sr_in) // g
+        self._n_in = 0
+        if self.up == self.down == 1:
+            return
+
+        max_rate = max(self.up, self.down)
+        half_len = 10 * max_rate
+        h = scipy.signal.firwin(
+            2 * half_len + 1, 1.0 / max_rate, window=("kaiser", 5.0)
+        )
+        # resample_poly と同様に，フィルタの遅延が出力サンプルの整数倍になるよう前に 0 を詰める
+        n_pre_pad = self.down - half_len % self.down
+        self.h = np.concatenate([np.zeros(n_pre_pad), h * self.up])
+        self.n_pre_remove = (half_len + n_pre_pad) // self.down
+
+        self._buf = np.zeros(0)
+        self._start = 0  # _buf[0] の入力信号中の位置 (down の倍数)
+        self._next = self.n_pre_remove  # 次に出力する (遅延込みの) 出力インデックス
+
+    def push(self, x):
+        """Feed the next block of input and return the output samples that are now complete"""
+        self._n_in += len(x)
+        if self.up == self.down == 1:
+            return np.asarray(x, dtype=np.float32)
+        return self._push(np.asarray(x, dtype=np.float64))
+
+    def flush(self):
+        """Return the remaining output samples after the last block"""
+        if self.up == self.down == 1:
+            return np.zeros(0, dtype=np.float32)
+        n_out = -(-self._n_in * self.up // self.down) + self.n_pre_remove
+        end = self._start + len(self._buf)
+        n_pad = max(0, -(-((n_out - 1) * self.down + 1) // self.up) - end)
+        return self._push(np.zeros(n_pad), limit=n_out)
+
+    def _push(self, x, limit=None):
+        self._buf = np.concatenate([self._buf, x])
+        end = self._start + len(self._buf)
+        # 出力 n はアップサンプル後の n * down 番目までの入力に依存する
+        n_end = (end * self.up - 1) // self.down + 1
+        if limit is not None:
+            n_end = min(n_end, limit)
+        if n_end <= self._next:
+            return np.zeros(0, dtype=np.float32)
+        y = scipy.signal.upfirdn(self.h, self._buf, self.up, self.down)
+        offset = self._start * self.up // self.down
+        out = y[self._next - offset : n_end - offset].astype(np.float32)
+        self._next = n_end
+
+        # 次の出力に必要な入力だけを残す
+        needed = max(0, self._next * self.down - (len(self.h) - 1)) // self.up
+        start = needed // self.down * self.down
+        if start > self._start:
+            self._buf = self._buf[start - self._start :]
+            self._start = start
+        return out
+
+
+class StreamingFramer:
+    """
+    Cuts a signal fed block by block into the same frames `frame_view` would cut the whole signal into.
+    With `include_last` a frame is returned as soon as its last sample arrives (for live input).
+    """
+
+    def __init__(self, frame_size, shift_size, include_last=False):
+        self.frame_size = frame_size
+        self.shift_size = shift_size
+        self.include_last = include_last
+        self._buf = np.zeros(0, dtype=np.float32)
+        self.n_frames = 0  # これまでに返したフレーム数
+
+    def push(self, x):
+        """Feed the next block and return the frames completed by it as a (n, frame_size) view"""
+        self._buf = np.concatenate([self._buf, np.asarray(x, dtype=np.float32)])
+        frames = frame_view(
+            self._buf, self.frame_size, self.shift_size, self.include_last
+        )
+        self.n_frames += len(frames)
+        self._buf = self._buf[len(frames) * self.shift_size :]
+        return frames
+
+
+class StreamingFrameFeatures:
+    """Log amplitude spectra and frame features (FRAME_FEATURE_DTYPE) of a signal fed chunk by chunk"""
+
+    def __init__(self, sr, frame_size, shift_size, window=None, include_last=False):
+        self.sr = sr
+        self.window = np.hamming(frame_size) if window is None else window
+        self.framer = StreamingFramer(frame_size, shift_size, include_last)
+
+    def push(self, x):
+        """Feed the next chunk and return (spectra, features) of the frames it completed"""
+        frames = self.framer.push(x)
+        spectra = log_spectra(frames, self.window)
+        return spectra, frame_features(frames, spectra, self.sr)
+
+
+def _read_blocks(audio_path, block_size):
+    """Yield (samplerate, mono float32 block) from the file as it is decoded"""
+    try:
+        f = soundfile.SoundFile(audio_path)
+    except RuntimeError:
+        # libsndfile で読めない形式 (MP3 など) は audioread で逐次デコードする
+        with audioread.audio_open(audio_path) as f:
+            for buf in f:
+                yield f.samplerate, decode_pcm16(buf, f.channels)
+        return
+    with f:
+        for block in f.blocks(blocksize=block_size, dtype="float32", always_2d=True):
+            yield f.samplerate, block.mean(axis=1)
+
+
+def expected_samples(audio_path, sr):
+    """
+    Number of samples `iter_blocks` yields for `audio_path`, from the file's header (exact for files libsndfile
+    reads, an estimate from the duration for the others)
+    """
+    try:
+        info = soundfile.info(audio_path)
+        # StreamingResampler は resample_poly と同じく ceil(n * sr / sr_in) サンプルを出す
+        return -(-info.frames * sr // info.samplerate)
+    except RuntimeError:
+        with audioread.audio_open(audio_path) as f:
+            return int(math.ceil(f.duration * sr))
+
+
+def iter_blocks(audio_path, sr, block_size=STREAM_BLOCK_SIZE):
+    """
+    Decode `audio_path` incrementally and yield mono float32 blocks of `block_size` samples resampled to `sr`
+    (the last block may be shorter). Memory use does not depend on the length of the file.
+    """
+    resampler = None
+    pending = []
+    n_pending = 0
+    for sr_in, x in _read_blocks(audio_path, block_size):
+        if resampler is None:
+            resampler = StreamingResampler(sr_in, sr)
+        pending.append(resampler.push(x))
+        n_pending += len(pending[-1])
+        if n_pending >= block_size:
+            x = np.concatenate(pending)
+            n = len(x) // block_size * block_size
+            for i in range(0, n, block_size):
+                yield x[i : i + block_size]
+            pending = [x[n:]]
+            n_pending = len(x) - n
+    if resampler is not None:
+        pending.append(resampler.flush())
+    x = np.concatenate(pending) if pending else np.zeros(0, dtype=np.float32)
+    for i in range(0, len(x), block_size):
+        yield x[i : i + block_size]
+
+
+def stream_features(
+    audio_path,
+    sr=AudioAnalyzer.SR,
+    frame_size=AudioAnalyzer.frame_size,
+    shift_size=AudioAnalyzer.shift_size,
+    block_size=STREAM_BLOCK_SIZE,
+):
+    """
+    Analyze `audio_path` while it is being decoded, yielding a FeatureBlock (first frame index, spectrogram rows,
+    volume, F0) as soon as each block of frames is complete. The frames are the same as `stft` would produce.
+    """
+    window = np.hamming(frame_size)
+    framer = StreamingFramer(frame_size, shift_size)
+    for block in iter_blocks(audio_path, sr, block_size):
+        start = framer.n_frames
+        frames = framer.push(block)
+        if len(frames) == 0:
+            continue
+        yield FeatureBlock(
+            start,
+            log_spectra(frames, window),
+            log_rms(frames).astype(np.float32),
+            frame_f0s(frames, sr),
+        )
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import io
+import logging
 from random import random
 
 import librosa
@@ -20,6 +21,11 @@ from kivy.uix.slider import Slider
 from kivy.uix.widget import Widget
 
 from analyze import AudioAnalyzer, get_f0
+from cache import FeatureCache
+from pyramid import WaveformPyramid
+from rendering import FigureRenderer, UpdateScheduler
+
+logger = logging.getLogger(__file__)
 
 
 class AudioView(BoxLayout):
@@ -39,10 +45,8 @@ class AudioView(BoxLayout):
         pass
 
     def update_fig(self):
-        # self.ax.relim()
-        # self.ax.autoscale_view()
-        self.fig.canvas.draw()
-        self.fig.canvas.flush_events()
+        """Schedule a redraw; only the animated artists are redrawn unless the axis limits changed"""
+        self.renderer.request()
 
 
 class WaveView(AudioView):
@@ -53,20 +57,32 @@ class WaveView(AudioView):
     def init(self, *args):
         """Initialize waveform plot and 2 lines showing the selected range for analysis"""
         wave = self.audio.wave
+        self.pyramid = WaveformPyramid(wave)
+        ymin, ymax = self.pyramid.min, self.pyramid.max
         self.fig, self.ax = plt.subplots()
-        (self.plot,) = self.ax.plot(np.arange(wave.shape[0]), wave)
-        (self.line1,) = self.ax.plot([0, 0], [min(wave), max(wave)], color="black")
-        (self.line2,) = self.ax.plot([0, 0], [min(wave), max(wave)], color="black")
-        self.ax.set_title(f"Waveform\nF0: {get_f0(self.audio.wave)}")
+        (self.plot,) = self.ax.plot(*self.envelope())
+        (self.line1,) = self.ax.plot([0, 0], [ymin, ymax], color="black")
+        (self.line2,) = self.ax.plot([0, 0], [ymin, ymax], color="black")
+        self.ax.set_xlim(0, len(wave))
+        self.ax.set_title(f"Waveform\nF0: {get_f0(self.audio.wave, self.audio.SR)}")
         self.ax.set_xlabel("Sample")
         widget = FigureCanvasKivyAgg(self.fig)
         self.add_widget(widget)
+        self.renderer = FigureRenderer(self.fig, widget, [self.line1, self.line2])
+        widget.bind(size=self.update_envelope)
+
+    def envelope(self):
+        """Min/max envelope of the whole waveform with about 2 points per pixel of the axes"""
+        return self.pyramid.envelope(0, len(self.audio.wave), self.ax.bbox.width)
+
+    def update_envelope(self, *args):
+        self.plot.set_data(*self.envelope())
+        self.renderer.request(full=True)
 
     def update_view(self, s: int, t: int, *args, **kwargs):
         """Update the 2 lines showing selected range"""
-        wave = self.audio.wave
-        self.line1.set_data([s, s], [min(wave), max(wave)])
-        self.line2.set_data([t, t], [min(wave), max(wave)])
+        self.line1.set_data([s, s], [self.pyramid.min, self.pyramid.max])
+        self.line2.set_data([t, t], [self.pyramid.min, self.pyramid.max])
         self.update_fig()
 
 
@@ -77,22 +93,48 @@ class SpectrogramView(AudioView):
 
     def init(self, *args):
         """Initialize spcectrogram plot and a line showing selected sample to show spectrum from"""
+        self.pyramid = self.audio.pyramid
+        n_frames, self.n_bins = self.audio.spectrogram.shape
+        self.samples_per_frame = len(self.audio.wave) / max(n_frames, 1)
         self.fig, self.ax = plt.subplots()
         self.im = self.ax.imshow(
-            np.flipud(self.audio.spectrogram.T),
+            np.zeros((1, 1)),
             extent=[0, len(self.audio.wave), 0, self.audio.SR / 2],
             aspect="auto",
             interpolation="nearest",
         )
+        self.set_image(0, n_frames)
+        self.im.autoscale()
         (self.line,) = self.ax.plot([0, 0], [0, self.audio.SR / 2], color="white")
         self.ax.set_title("Spectrogram")
         self.ax.set_xlabel("Sample")
         self.ax.set_ylabel("frequency [Hz]")
         widget = FigureCanvasKivyAgg(self.fig)
         self.add_widget(widget)
+        self.renderer = FigureRenderer(self.fig, widget, [self.line])
+
+    def set_image(self, s: int, t: int):
+        """Show frames [s, t) from the pyramid level matching the size of the axes in pixels"""
+        image, (f0, f1), (b0, b1) = self.pyramid.view(
+            s, t, self.ax.bbox.width, self.ax.bbox.height
+        )
+        hz_per_bin = self.audio.SR / 2 / self.n_bins
+        self.im.set_data(np.flipud(image.T))
+        self.im.set_extent(
+            [
+                f0 * self.samples_per_frame,
+                f1 * self.samples_per_frame,
+                b0 * hz_per_bin,
+                b1 * hz_per_bin,
+            ]
+        )
+        self.ax.set_ylim(0, self.audio.SR / 2)
 
     def update_view(self, s: int, t: int, value: int, *args, **kwargs):
         """Update spectrogram view to the given [s, t] range, and the line showing selected sample"""
+        self.set_image(
+            int(s / self.samples_per_frame), int(np.ceil(t / self.samples_per_frame))
+        )
         self.ax.set_xlim(s, t)
 
         x = value * len(self.audio.wave) / self.audio.spectrogram.shape[0]
@@ -119,11 +161,23 @@ class SpectrumView(AudioView):
         (self.plot,) = self.ax.plot(self.xs(), self.audio.spectrogram[0])
         (self.line,) = self.ax.plot([0, self.audio.SR / 2], [0, 0], color="black")
         self.ax.set_xlim(0, self.audio.SR / 2)
-        self.ax.set_ylim(self.audio.spectrogram.min(), self.audio.spectrogram.max())
+        self.ax.set_ylim(*self.value_range())
         self.ax.set_title("Spectrum")
         self.ax.set_xlabel("Frequency [Hz]")
         widget = FigureCanvasKivyAgg(self.fig)
         self.add_widget(widget)
+        self.renderer = FigureRenderer(self.fig, widget, [self.plot, self.line])
+
+    def value_range(self, n_samples=32):
+        """
+        Min / max of `n_samples` frames spread over the spectrogram (log(0) = -inf excluded), so a
+        LazySpectrogram computes at most that many tiles instead of all of them
+        """
+        spectrogram = self.audio.spectrogram
+        frames = np.linspace(0, len(spectrogram) - 1, min(n_samples, len(spectrogram)))
+        sample = np.stack([spectrogram[int(t)] for t in frames])
+        sample = sample[np.isfinite(sample)]
+        return float(sample.min()), float(sample.max())
 
     def update_view(self, sample_t: int, max_freq: int, *args, **kwargs):
         """Update plot for updated sample & max_freq values"""
@@ -143,10 +197,14 @@ class MainWidget(BoxLayout):
     slider = ObjectProperty(None)
     freq_slider = ObjectProperty(None)
 
-    audio = ObjectProperty(AudioAnalyzer("data/aiueo.wav"))
+    audio = ObjectProperty(
+        AudioAnalyzer("data/aiueo.wav", cache=FeatureCache(), lazy=True)
+    )
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        # スライダーのイベントはフレームごとにまとめてからビューを更新する
+        self.scheduler = UpdateScheduler()
         self.wave_slider.bind(value=self.wave_slider_update_view)
         self.wave_frame_slider.bind(value=self.wave_slider_update_view)
         self.slider.bind(value=self.slider_update_view)
@@ -168,18 +226,30 @@ class MainWidget(BoxLayout):
         )
         self.slider.min = scaler(self.s())
         self.slider.max = scaler(self.t())
-        self.wave.update_view(self.s(), self.t())
-        self.spectrogram.update_view(self.s(), self.t(), int(self.slider.value))
-        self.spectrum.update_view(int(self.slider.value), int(self.freq_slider.value))
+        self.scheduler.schedule(self.wave.update_view, self.s(), self.t())
+        self.schedule_spectrogram()
+        self.schedule_spectrum()
 
     def slider_update_view(self, *args, **kwargs):
         """Callback for when slider is updated"""
-        self.spectrogram.update_view(self.s(), self.t(), int(self.slider.value))
-        self.spectrum.update_view(int(self.slider.value), int(self.freq_slider.value))
+        self.schedule_spectrogram()
+        self.schedule_spectrum()
 
     def freq_slider_update_view(self, *args, **kwargs):
         """Callback for when freq_slider is updated"""
-        self.spectrum.update_view(int(self.slider.value), int(self.freq_slider.value))
+        self.schedule_spectrum()
+
+    def schedule_spectrogram(self):
+        self.scheduler.schedule(
+            self.spectrogram.update_view, self.s(), self.t(), int(self.slider.value)
+        )
+
+    def schedule_spectrum(self):
+        self.scheduler.schedule(
+            self.spectrum.update_view,
+            int(self.slider.value),
+            int(self.freq_slider.value),
+        )
 
 
 class TebuAudioApp(App):
@@ -187,6 +257,16 @@ class TebuAudioApp(App):
         self.root = MainWidget()
         return self.root
 
+    def on_stop(self):
+        stats = self.root.scheduler.stats()
+        logger.info(
+            "view updates: %d requested, %d merged, %d skipped, %d drawn",
+            stats["requests"],
+            stats["merged"],
+            stats["skipped"],
+            stats["updates"],
+        )
+
 
 if __name__ == "__main__":
     TebuAudioApp().run()
@@ -0,0 +1,249 @@
+"""
+Vowel recognition from the low-quefrency cepstrum (spectral envelope) of each frame.
+
+    python app/vowel.py data/aiueo.wav data/aiueo2.wav
+
+trains a model on the five voiced segments of the first file (spoken "a i u e o"), then classifies the second
+file offline and chunk by chunk as the live app would, and reports accuracy and time per chunk.
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from analyze import AudioAnalyzer, LiveAnalyzer, spectrogram_blocks
+
+VOWELS = ("a", "i", "u", "e", "o")
+
+# 包絡として使うケプストラム係数の数 (c0 は音量なので使わない)
+N_COEFFS = 20
+
+# log(0) = -inf のビンはこの値に置き換える
+LOG_FLOOR = np.log(1e-10)
+
+
+def cepstra(spectrogram, n_coeffs=N_COEFFS):
+    """
+    Real cepstrum coefficients c1 .. c{n_coeffs} of every frame of a log amplitude spectrogram, shape
+    (n_frames, n_coeffs), computed with one irfft per block of frames.
+    """
+    n_frames, n_bins = spectrogram.shape
+    frame_size = 2 * (n_bins - 1)
+    coeffs = np.empty((n_frames, n_coeffs), dtype=np.float32)
+    for i, block in spectrogram_blocks(spectrogram):
+        # 対数振幅スペクトルは実数の偶関数なので，irfft がそのまま実ケプストラムになる
+        cepstrum = np.fft.irfft(np.maximum(block, LOG_FLOOR), frame_size, axis=1)
+        coeffs[i : i + len(block)] = cepstrum[:, 1 : n_coeffs + 1]
+    return coeffs
+
+
+def voiced_segments(db, margin=1.5, min_frames=20):
+    """
+    (start, end) frame ranges where the volume `db` (log RMS) is more than `margin` above the background level
+    (30th percentile), ignoring segments shorter than `min_frames`.
+    """
+    db = np.asarray(db)
+    voiced = np.concatenate([[False], db > np.percentile(db, 30) + margin, [False]])
+    edges = np.flatnonzero(np.diff(voiced.astype(np.int8)))
+    return [(s, e) for s, e in zip(edges[0::2], edges[1::2]) if e - s >= min_frames]
+
+
+class CepstralNormalizer:
+    """
+    Cepstral mean and variance normalization, which removes the differences between microphones, rooms and
+    speakers that otherwise dominate the low-quefrency coefficients. `update` tracks the statistics of live
+    input with an exponential moving average over about `window` frames.
+    """
+
+    def __init__(self, mean, var, window=100):
+        self.mean = np.array(mean, dtype=np.float32)
+        self.var = np.array(var, dtype=np.float32)
+        self.window = window
+
+    @classmethod
+    def fit(cls, features, window=100):
+        return cls(features.mean(axis=0), features.var(axis=0), window)
+
+    def update(self, features):
+        for x in np.atleast_2d(features):
+            diff = x - self.mean
+            self.mean += diff / self.window
+            self.var += (diff * (x - self.mean) - self.var) / self.window
+
+    def __call__(self, features):
+        return (features - self.mean) / np.sqrt(np.maximum(self.var, 1e-10))
+
+
+class VowelClassifier:
+    """
+    Per-class diagonal Gaussian (or, with `kind="centroid"`, nearest centroid) model of normalized cepstrum
+    vectors. All classes are scored at once with array operations, so classifying a whole song is a few matrix
+    operations. The normalization statistics of the training data are kept as a starting point for live input.
+    """
+
+    def __init__(self, kind="gaussian"):
+        self.kind = kind
+        self.labels = None
+        self.means = None
+        self.variances = None
+        self.normalizer = None
+
+    def fit(self, features, labels):
+        """Train on raw cepstra (see `cepstra`) of voiced frames and their labels"""
+        self.normalizer = CepstralNormalizer.fit(features)
+        features = self.normalizer(features)
+        labels = np.asarray(labels)
+        self.labels = tuple(dict.fromkeys(labels.tolist()))  # 出てきた順
+        self.means = np.stack(
+            [features[labels == label].mean(axis=0) for label in self.labels]
+        )
+        self.variances = np.stack(
+            [features[labels == label].var(axis=0) for label in self.labels]
+        )
+        # 分散が 0 に近い係数で尤度が発散しないよう，全体の分散の 1% を下限にする
+        self.variances = np.maximum(self.variances, 0.01 * features.var(axis=0))
+        return self
+
+    def log_likelihood(self, features):
+        """Score of each row of normalized `features` for each class, shape (n_frames, n_classes)"""
+        diff = np.atleast_2d(features)[:, None, :] - self.means[None]
+        if self.kind == "centroid":
+            return -np.sum(diff ** 2, axis=-1)
+        return -0.5 * np.sum(
+            diff ** 2 / self.variances + np.log(2 * np.pi * self.variances), axis=-1
+        )
+
+    def predict(self, features):
+        """Index into `labels` of the most likely class of each row of normalized `features`"""
+        return np.argmax(self.log_likelihood(features), axis=1)
+
+    def save(self, path):
+        np.savez(
+            path,
+            kind=self.kind,
+            labels=np.array(self.labels),
+            means=self.means,
+            variances=self.variances,
+            norm_mean=self.normalizer.mean,
+            norm_var=self.normalizer.var,
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        model = cls(str(data["kind"]))
+        model.labels = tuple(data["labels"].tolist())
+        model.means = data["means"]
+        model.variances = data["variances"]
+        model.normalizer = CepstralNormalizer(data["norm_mean"], data["norm_var"])
+        return model
+
+
+def train_on_segments(audio, labels=VOWELS, kind="gaussian"):
+    """Train a VowelClassifier on an AudioAnalyzer whose voiced segments are the vowels `labels` in order"""
+    segments = voiced_segments(audio.features["db"])
+    if len(segments) != len(labels):
+        raise ValueError(
+            f"found {len(segments)} voiced segments, expected {len(labels)}"
+        )
+    features = cepstra(audio.spectrogram)
+    x = np.concatenate([features[s:e] for s, e in segments])
+    y = np.concatenate([[label] * (e - s) for (s, e), label in zip(segments, labels)])
+    return VowelClassifier(kind).fit(x, y)
+
+
+def classify(audio, classifier):
+    """
+    Vowel index (into `classifier.labels`) of every frame of an AudioAnalyzer, or -1 for unvoiced frames.
+    The input is normalized with the statistics of its own voiced frames.
+    """
+    features = cepstra(audio.spectrogram)
+    voiced = np.zeros(len(features), dtype=bool)
+    for s, e in voiced_segments(audio.features["db"]):
+        voiced[s:e] = True
+    result = np.full(len(features), -1, dtype=np.int64)
+    if voiced.any():
+        normalize = CepstralNormalizer.fit(features[voiced])
+        result[voiced] = classifier.predict(normalize(features[voiced]))
+    return result
+
+
+class VowelRecognizer:
+    """
+    Classifies live input one spectrum at a time (e.g. each new row of LiveAnalyzer.spectra).
+    Frames quieter than `db_threshold` are unvoiced (None); the label reported is the majority of the last
+    `smoothing` voiced frames, so the output lags the input by at most `smoothing` spectra.
+    """
+
+    def __init__(self, classifier, db_threshold=-4.5, smoothing=3, window=100):
+        self.classifier = classifier
+        # 学習データの統計から始めて，入力に合わせて更新していく
+        self.normalizer = CepstralNormalizer(
+            classifier.normalizer.mean, classifier.normalizer.var, window
+        )
+        self.db_threshold = db_threshold
+        self.smoothing = smoothing
+        self._recent = np.full(smoothing, -1, dtype=np.int64)
+        self._n = 0
+        self.current = None
+
+    def push(self, log_spectrum, db):
+        if db < self.db_threshold:
+            self._recent[:] = -1
+            self.current = None
+            return None
+        features = cepstra(np.asarray(log_spectrum)[None])
+        self.normalizer.update(features)
+        index = self.classifier.predict(self.normalizer(features))[0]
+        self._recent[self._n % self.smoothing] = index
+        self._n += 1
+        votes = np.bincount(
+            self._recent[self._recent >= 0], minlength=len(self.classifier.labels)
+        )
+        self.current = self.classifier.labels[int(np.argmax(votes))]
+        return self.current
+
+
+def main(train_path="data/aiueo.wav", test_path="data/aiueo2.wav"):
+    classifier = train_on_segments(AudioAnalyzer(train_path))
+    test = AudioAnalyzer(test_path)
+    segments = voiced_segments(test.features["db"])
+
+    st = time.perf_counter()
+    predicted = classify(test, classifier)
+    elapsed = time.perf_counter() - st
+    correct = total = 0
+    for (s, e), label in zip(segments, VOWELS):
+        names = np.array(classifier.labels + ("-",))[predicted[s:e]]
+        print(f"{label}: {np.mean(names == label) * 100:5.1f}% of {e - s} frames")
+        correct += np.sum(names == label)
+        total += e - s
+    print(
+        f"offline: {correct / total * 100:.1f}% of voiced frames,"
+        f" {len(predicted)} frames in {elapsed * 1000:.1f} ms"
+    )
+
+    # ライブ入力と同じく，チャンクごとに最新のスペクトルを分類する
+    sr, chunk = test.SR, 1024
+    live = LiveAnalyzer(sr, chunk)
+    recognizer = VowelRecognizer(classifier)
+    times = []
+    result = []
+    for i in range(0, len(test.wave) - chunk + 1, chunk):
+        live.process(test.wave[i : i + chunk])
+        spectra = live.spectra.read()
+        if len(spectra) == 0:
+            continue
+        st = time.perf_counter()
+        label = recognizer.push(spectra[-1], live.features.latest(1)["db"][0])
+        times.append(time.perf_counter() - st)
+        result.append(label or "-")
+    print("live:", "".join(result))
+    print(
+        f"live: mean {np.mean(times) * 1000:.3f} ms, max {np.max(times) * 1000:.3f} ms per chunk"
+    )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])